@@ -6,11 +6,20 @@ import os
 from lex import lexconfig
 
 PIPELINE = [
+    # collect_frequencies does the work of both collect_entry_frequencies
+    #  and collect_all_frequencies in a single pass
+    ('collect_frequencies', 0),
+    # distributed_collect is collect_frequencies split into letter tasks
+    #  shared between hosts (see processors/coordinator.py)
+    ('distributed_collect', 0),
     ('collect_entry_frequencies', 0),
     ('collect_all_frequencies', 0),
     ('build_csv', 1),
+    ('build_sqlite', 0),
     # analysis of the frequency output
     ('analyse_frequency_data', 0),
+    # period x band distributions at entry, wordclass and type level
+    ('band_distributions', 0),
     ('compare_with_oec', 0),
     ('pos_ratio', 0),
     ('rank_entries', 0),
@@ -18,8 +27,15 @@ PIPELINE = [
     # currency
     ('raw_currency_data', 0),
     ('estimate_currency', 0),
+    ('currency_sweep', 0),
+    # comparison with the previous build
+    ('diff_builds', 0),
 ]
 
+# Letters to process; None for the full alphabet (can be set using
+#  pipeline.py --letters)
+LETTERS = None
+
 OED_ROOT = lexconfig.OED_DIR
 PROJECT_ROOT = os.path.join(OED_ROOT, 'projects', 'frequency')
 
@@ -29,9 +45,91 @@ ANALYSIS_DIR = os.path.join(PROJECT_ROOT, 'analysis')
 RANKING_FILE = os.path.join(ANALYSIS_DIR, 'ranking.csv')
 CURRENCY_DIR = os.path.join(PROJECT_ROOT, 'currency')
 CSV_FILE = os.path.join(PROJECT_ROOT, 'oed_frequencies.csv')
+SQLITE_FILE = os.path.join(PROJECT_ROOT, 'oed_frequencies.sqlite')
+PROFILE_DIR = os.path.join(PROJECT_ROOT, 'profiles')
+DIFF_DIR = os.path.join(PROJECT_ROOT, 'diff')
+COORDINATION_DIR = os.path.join(PROJECT_ROOT, 'coordination')
+STAGE_CACHE_DIR = os.path.join(PROJECT_ROOT, 'stage_cache')
+# Outputs of runs covering only some letters (see pipeline.scope_outputs)
+PARTIAL_DIR = os.path.join(PROJECT_ROOT, 'partial')
 OEC_FREQUENCY_FILE = os.path.join(lexconfig.GEL_DIR, 'resources', 'oec',
                                   'oec_lempos_frequencies.txt')
 
+# Reader used by stages that iterate through the frequency XML files:
+#  'iterparse' for the constant-memory FrequencyReader, or 'tree' for
+#  lex's FrequencyIterator. Only switch to 'iterparse' once the parity
+#  check (tests/test_frequencyreader.py, or
+#  processors.frequencyreader.compare_readers) passes on the current
+#  build.
+FREQUENCY_READER = 'tree'
+
+# 'matrix' to run analyse_frequency_data on a numpy matrix of all
+#  entries, or 'iterative' to evaluate entries one at a time (the output
+#  is the same; see tests/test_frequencyanalysis.py). 'iterative' stays
+#  the default until the matrix mode has been shown to be faster on the
+#  full dictionary.
+ANALYSIS_MODE = 'iterative'
+
+# Fraction of entries (e.g. 0.02) to sample in analyse_frequency_data,
+#  pos_ratio, raw_currency_data and estimate_currency, for quick
+#  exploratory runs; None to process every entry. Can be set using
+#  pipeline.py --sample.
+SAMPLE_RATE = None
+
+# Number of processes across which analyse_frequency_data, pos_ratio,
+#  band_distributions and raw_currency_data split the alphabet, one
+#  letter per task (see processors/shards.py); 0 or 1 to run in a single
+#  process. The output is the same either way. Can be set using
+#  pipeline.py --processes.
+ANALYSIS_PROCESSES = 0
+
+# If True, stages after collect_frequencies that read its output letter
+#  by letter (build_csv, analyse_frequency_data, band_distributions,
+#  pos_ratio, raw_currency_data, and with them the index) process each
+#  letter as soon as it has been collected, in ANALYSIS_PROCESSES
+#  worker processes (at least 1) running alongside the collector. The
+#  output is the same. Stages whose outputs may be restored from the
+#  stage cache aren't streamed while STAGE_CACHE is on, and no worker
+#  processes are started if there's nothing to stream (see
+#  pipeline.open_stream).
+LETTER_PIPELINING = False
+
+# Number of worker processes that distributed_collect starts on the
+#  coordinating host; workers on other hosts are started with
+#  'pipeline.py --worker' (COORDINATION_DIR must be on a filesystem
+#  shared by all hosts).
+LOCAL_WORKERS = 0
+
+# Cache stage outputs, keyed on the stage's inputs, config settings and
+#  code (see processors/stagecache.py and pipeline.CACHED_STAGES), so
+#  that re-running an unchanged stage just restores its outputs. Off by
+#  default, because data read through lex (e.g. the vital statistics
+#  cache) isn't fingerprinted: only switch it on (here, or using
+#  pipeline.py --cache) while that data isn't changing. STAGE_CACHE_SIZE
+#  is the limit (in bytes) beyond which least recently used outputs are
+#  evicted.
+STAGE_CACHE = False
+STAGE_CACHE_SIZE = 20 * 1024 ** 3
+
+# Profiling (see processors/profiling.py; can also be set using the
+#  FREQUENCY_PROFILE* environment variables). 'stages' lists the pipeline
+#  stages to profile; 'mode' is 'cprofile', 'sample', or 'tracemalloc';
+#  'letters' and 'files' optionally narrow profiling down to particular
+#  letters or frequency files within the stage.
+PROFILE = {
+    'stages': [],
+    'mode': 'cprofile',
+    'letters': [],
+    'files': [],
+}
+
+# Previous build to compare against in diff_builds: either a frequency
+#  directory or an oed_frequencies.csv file. The current build compared
+#  is FULL_FREQUENCY_DIR. Changes in frequency smaller than
+#  DIFF_THRESHOLD (relative to the previous frequency) are not reported.
+PREVIOUS_BUILD = os.path.join(PROJECT_ROOT, 'previous', 'oed_frequencies.csv')
+DIFF_THRESHOLD = 0.1
+
 # Only entries with last dates between range_start and range_end will
 #  be evaluated.
 RANGE_START = 1700
@@ -45,3 +143,12 @@ LOGICAL_CURRENCY_DATE = 1850
 LOGICAL_CURRENCY_SIZE = 20
 LOGICAL_CURRENCY_SUFFIXES1 = 'ing|ed|ness'
 LOGICAL_CURRENCY_SUFFIXES2 = 'less|able|ly'
+
+# Parameter grid for currency_sweep: maps CurrencyEvaluator parameter
+#  names (or 'range_start'/'range_end') to lists of values to try. Every
+#  combination is evaluated.
+CURRENCY_SWEEP = {
+    'odo_linked': [6, 9, 12],
+    'low_frequency': [0.001, 0.002, 0.005],
+    'early_date': [1800, 1850],
+}
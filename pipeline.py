@@ -1,56 +1,540 @@
 """
 Pipeline - Runs processes for building OED frequency and currency data
+
+Usage:
+    python pipeline.py [--stages STAGES] [--letters LETTERS]
+                       [--in-root DIR] [--out-root DIR] [--processes N]
+                       [--cache | --no-cache] [--dry-run]
+    python pipeline.py --worker [--coord-dir DIR]
+
+With no options, runs the stages switched on in frequencyconfig.PIPELINE
+for the full alphabet. With --worker, runs tasks published by the
+distributed_collect stage (possibly running on another host) until
+they're all done.
+
+With the stage cache on (STAGE_CACHE or --cache), stages listed in
+CACHED_STAGES are skipped if their inputs, config settings and code
+haven't changed since a previous run: their outputs are restored from
+the cache instead (see processors/stagecache.py).
+
+If LETTER_PIPELINING is on, stages after collect_frequencies that read
+its output letter by letter (see letter_consumer()) start on each letter
+as soon as it has been collected, rather than waiting for the whole
+alphabet (see processors.shards.LetterStream).
 """
 
 import os
+import shutil
+import string
+import argparse
+import functools
+import importlib.util
 
 import frequencyconfig
+from processors.profiling import profile_stage
+
+# Paths relocated by --in-root (frequency XML) and --out-root (everything
+#  else produced by the pipeline)
+INPUT_PATHS = ('FREQUENCY_DIR', 'FULL_FREQUENCY_DIR')
+OUTPUT_PATHS = ('ANALYSIS_DIR', 'RANKING_FILE', 'CURRENCY_DIR', 'CSV_FILE',
+                'SQLITE_FILE', 'PROFILE_DIR', 'DIFF_DIR', 'COORDINATION_DIR',
+                'STAGE_CACHE_DIR', 'PARTIAL_DIR')
+
+# Outputs that only cover the letters (and entries) processed: a run
+#  restricted to a subset of letters, or to a sample of entries, writes
+#  them under PARTIAL_DIR, so that they don't overwrite the full results
+#  (see scope_outputs()). The
+#  frequency directories, their index, and the SQLite database are
+#  updated letter by letter instead.
+PARTIAL_PATHS = ('ANALYSIS_DIR', 'CURRENCY_DIR', 'CSV_FILE', 'DIFF_DIR')
+
+ANALYSIS_SERIES = ('band_distribution', 'total_frequency', 'high_frequency',
+                   'high_delta_up', 'high_delta_down', 'delta_dist',
+                   'plural_to_singular', 'high_frequency_rare',
+                   'frequency_to_size_high', 'frequency_to_size_low',
+                   'band_distribution_estimate', 'total_frequency_estimate')
+
+# Stages whose outputs can be restored from the stage cache. Paths are
+#  given as a frequencyconfig setting, optionally followed by a path
+#  relative to it; 'config' lists the frequencyconfig settings that
+#  affect the output, 'code' the modules that produce it, and 'lex' the
+#  lex modules it uses (pipeline.py and processors/shards.py are always
+#  included). Data read through lex, such as the vital statistics cache,
+#  is not fingerprinted, which is why STAGE_CACHE is off by default.
+#  Stages that update their output in place, like build_sqlite, can't
+#  be cached.
+CACHED_STAGES = {
+    'build_csv': {
+        'inputs': [('FULL_FREQUENCY_DIR',)],
+        'outputs': [('CSV_FILE',)],
+        'config': ['LETTERS', 'FREQUENCY_READER'],
+        'code': ['xmltocsv', 'frequencyreader'],
+        'lex': ['lex.frequencytable',
+                'lex.oed.resources.frequencyiterator'],
+    },
+    'analyse_frequency_data': {
+        'inputs': [('FREQUENCY_DIR',)],
+        'outputs': [('ANALYSIS_DIR', '%s.csv' % series)
+                    for series in ANALYSIS_SERIES],
+        'config': ['LETTERS', 'FREQUENCY_READER', 'ANALYSIS_MODE',
+                   'SAMPLE_RATE'],
+        'code': ['frequencyanalysis', 'frequencyreader', 'sampling'],
+        'lex': ['lex.frequencytable',
+                'lex.oed.resources.frequencyiterator',
+                'lex.oed.resources.vitalstatistics'],
+    },
+    'band_distributions': {
+        'inputs': [('FREQUENCY_DIR',)],
+        'outputs': [('ANALYSIS_DIR', 'band_distribution_%s.csv' % level)
+                    for level in ('entries', 'wordclass_sets', 'types')],
+        'config': ['LETTERS', 'FREQUENCY_READER'],
+        'code': ['banddistribution', 'frequencyreader'],
+        'lex': ['lex.frequencytable',
+                'lex.oed.resources.frequencyiterator'],
+    },
+    'raw_currency_data': {
+        'inputs': [('FREQUENCY_DIR',)],
+        'outputs': [('CURRENCY_DIR', 'source_raw.csv')],
+        'config': ['LETTERS', 'FREQUENCY_READER', 'SAMPLE_RATE',
+                   'RANGE_START', 'RANGE_END', 'LOGICAL_CURRENCY_DATE',
+                   'LOGICAL_CURRENCY_SIZE', 'LOGICAL_CURRENCY_SUFFIXES1',
+                   'LOGICAL_CURRENCY_SUFFIXES2'],
+        'code': ['currency', 'frequencyreader', 'sampling'],
+        'lex': ['lex.frequencytable',
+                'lex.oed.resources.frequencyiterator',
+                'lex.oed.resources.vitalstatistics'],
+    },
+    'estimate_currency': {
+        'inputs': [('CURRENCY_DIR', 'source_raw.csv')],
+        'outputs': [('CURRENCY_DIR', 'source.csv'),
+                    ('CURRENCY_DIR', 'source_estimates.csv')],
+        'config': ['SAMPLE_RATE', 'RANGE_START', 'RANGE_END'],
+        'code': ['currency', 'sampling'],
+    },
+    'currency_sweep': {
+        'inputs': [('CURRENCY_DIR', 'source_raw.csv')],
+        'outputs': [('CURRENCY_DIR', 'sweep.csv')],
+        'config': ['CURRENCY_SWEEP', 'RANGE_START', 'RANGE_END'],
+        'code': ['currency'],
+    },
+    'diff_builds': {
+        'inputs': [('PREVIOUS_BUILD',), ('FULL_FREQUENCY_DIR',)],
+        'outputs': [('DIFF_DIR', 'changes.csv'), ('DIFF_DIR', 'summary.csv')],
+        'config': ['LETTERS', 'FREQUENCY_READER', 'DIFF_THRESHOLD'],
+        'code': ['frequencydiff', 'frequencyreader'],
+        'lex': ['lex.frequencytable',
+                'lex.oed.resources.frequencyiterator'],
+    },
+}
 
 
 def dispatch():
-    for function_name, status in frequencyconfig.PIPELINE:
-        if status:
+    for directory in (frequencyconfig.ANALYSIS_DIR,
+                      frequencyconfig.CURRENCY_DIR,
+                      os.path.dirname(frequencyconfig.CSV_FILE)):
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+    stages = enabled_stages()
+    stream = None
+    try:
+        for function_name in stages:
             print('=' * 30)
             print('Running "%s"...' % function_name)
             print('=' * 30)
             func = globals()[function_name]
-            func()
+            if (function_name == 'collect_frequencies' and
+                    frequencyconfig.LETTER_PIPELINING):
+                stream = open_stream(stages[stages.index(function_name) + 1:])
+                if stream is not None:
+                    func = functools.partial(func, stream=stream)
+            elif stream is not None and stream.has(function_name):
+                func = functools.partial(_finish_streamed, function_name,
+                                         stream)
+            with profile_stage(function_name):
+                run_stage(function_name, func)
+    finally:
+        if stream is not None:
+            stream.close()
+
+
+def open_stream(later_stages):
+    """
+    Start a LetterStream, feeding each of the later stages that can
+    consume collect_frequencies' output letter by letter. Returns None
+    (so that no pool is started) if there are no such stages.
+
+    With the stage cache on, cached stages aren't streamed: whether
+    their outputs can be restored can't be known until their input has
+    been collected, and streaming them would waste the work on a hit.
+    They're run (or restored) after collect_frequencies as usual.
+    """
+    from processors.shards import LetterStream
+    consumers = []
+    for function_name in later_stages:
+        if frequencyconfig.STAGE_CACHE and function_name in CACHED_STAGES:
+            continue
+        accumulate = letter_consumer(function_name)
+        if accumulate is not None:
+            consumers.append((function_name, accumulate))
+    if not consumers:
+        return None
+    stream = LetterStream(frequencyconfig.ANALYSIS_PROCESSES)
+    for function_name, accumulate in consumers:
+        print('Streaming letters to "%s"' % function_name)
+        stream.add(function_name, accumulate)
+    return stream
+
+
+def _finish_streamed(function_name, stream):
+    globals()[function_name](accumulator=stream.result(function_name))
+
+
+def run_stage(function_name, func):
+    spec = CACHED_STAGES.get(function_name)
+    if spec is None or not frequencyconfig.STAGE_CACHE:
+        func()
+        return
+
+    from processors.stagecache import StageCache
+    cache = StageCache(frequencyconfig.STAGE_CACHE_DIR,
+                       frequencyconfig.STAGE_CACHE_SIZE)
+    code_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                            'processors')
+    code = [os.path.abspath(__file__), os.path.join(code_dir, 'shards.py')]
+    code.extend([os.path.join(code_dir, module + '.py')
+                 for module in spec['code']])
+    code.extend([importlib.util.find_spec(module).origin
+                 for module in spec.get('lex', [])])
+    key = cache.fingerprint(
+        function_name,
+        [_config_path(path) for path in spec['inputs']],
+        {name: getattr(frequencyconfig, name) for name in spec['config']},
+        code,
+    )
+    outputs = [_config_path(path) for path in spec['outputs']]
+    if cache.restore(key, outputs):
+        print('Unchanged since a previous run: restored outputs from cache')
+    else:
+        func()
+        cache.store(key, outputs)
+
+
+def _config_path(path):
+    return os.path.join(getattr(frequencyconfig, path[0]), *path[1:])
+
+
+def enabled_stages():
+    return [function_name for function_name, status
+            in frequencyconfig.PIPELINE if status]
+
+
+def print_plan():
+    letters = frequencyconfig.LETTERS or string.ascii_lowercase
+    print('Stages:')
+    for i, function_name in enumerate(enabled_stages()):
+        print('  %d. %s' % (i + 1, function_name))
+    print('Letters: %s' % ''.join(letters))
+    if frequencyconfig.SAMPLE_RATE is not None:
+        print('Sample rate: %s' % frequencyconfig.SAMPLE_RATE)
+    print('Stage cache: %s' % ('on' if frequencyconfig.STAGE_CACHE
+                               else 'off'))
+    print('Paths:')
+    for name in INPUT_PATHS + OUTPUT_PATHS:
+        print('  %s = %s' % (name, getattr(frequencyconfig, name)))
+
+
+def configure(argv=None):
+    """
+    Parse command-line options, and apply them to frequencyconfig.
+    Returns the parsed options.
+    """
+    stage_names = [function_name for function_name, _
+                   in frequencyconfig.PIPELINE]
+    parser = argparse.ArgumentParser(
+        description='Build OED frequency and currency data.')
+    parser.add_argument('-s', '--stages',
+                        help='comma-separated list of stages to run '
+                             '(overrides frequencyconfig.PIPELINE); '
+                             'one or more of: %s' % ', '.join(stage_names))
+    parser.add_argument('-l', '--letters',
+                        help='restrict processing to these letters, '
+                             'e.g. "qx"')
+    parser.add_argument('--in-root',
+                        help='root directory for frequency XML data')
+    parser.add_argument('--out-root',
+                        help='root directory for analysis, currency, and '
+                             'other output')
+    parser.add_argument('--sample', type=float,
+                        help='analyse a deterministic sample of this '
+                             'fraction of entries, e.g. 0.02')
+    parser.add_argument('--worker', action='store_true',
+                        help='run as a worker for distributed_collect')
+    parser.add_argument('--coord-dir',
+                        help='coordination directory for distributed_collect '
+                             '(shared by all hosts)')
+    parser.add_argument('--local-workers', type=int,
+                        help='number of worker processes distributed_collect '
+                             'starts on this host')
+    parser.add_argument('-j', '--processes', type=int,
+                        help='number of processes for the analysis and '
+                             'currency stages')
+    parser.add_argument('--cache', action='store_true',
+                        help='restore unchanged stages\' outputs from the '
+                             'stage cache')
+    parser.add_argument('--no-cache', action='store_true',
+                        help='run every stage, ignoring cached outputs')
+    parser.add_argument('-n', '--dry-run', action='store_true',
+                        help='print the execution plan without running it')
+    options = parser.parse_args(argv)
+
+    if options.stages:
+        selected = [s.strip() for s in options.stages.split(',')
+                    if s.strip()]
+        unknown = [s for s in selected if s not in stage_names]
+        if unknown:
+            parser.error('unknown stage(s): %s' % ', '.join(unknown))
+        frequencyconfig.PIPELINE = [(function_name, int(function_name in
+                                                        selected))
+                                    for function_name in stage_names]
+
+    if options.letters:
+        letters = sorted(set(options.letters.lower().replace(',', '')))
+        invalid = [l for l in letters if l not in string.ascii_lowercase]
+        if invalid:
+            parser.error('invalid letter(s): %s' % ', '.join(invalid))
+        frequencyconfig.LETTERS = letters
+
+    if options.sample is not None:
+        if not 0 < options.sample <= 1:
+            parser.error('sample must be between 0 and 1')
+        frequencyconfig.SAMPLE_RATE = options.sample
+
+    if options.in_root:
+        _relocate(INPUT_PATHS, options.in_root)
+    if options.out_root:
+        _relocate(OUTPUT_PATHS, options.out_root)
+    if options.coord_dir:
+        frequencyconfig.COORDINATION_DIR = options.coord_dir
+    if options.local_workers is not None:
+        frequencyconfig.LOCAL_WORKERS = options.local_workers
+    if options.processes is not None:
+        frequencyconfig.ANALYSIS_PROCESSES = options.processes
+    if options.cache:
+        frequencyconfig.STAGE_CACHE = True
+    if options.no_cache:
+        frequencyconfig.STAGE_CACHE = False
+    scope_outputs()
+    return options
+
+
+def scope_outputs():
+    """
+    Move PARTIAL_PATHS to a directory for this subset of letters and/or
+    sample under PARTIAL_DIR, if the run doesn't cover every entry.
+    """
+    scope = partial_scope()
+    if scope is None:
+        return
+    for name in PARTIAL_PATHS:
+        path = getattr(frequencyconfig, name)
+        setattr(frequencyconfig, name, os.path.join(
+            frequencyconfig.PARTIAL_DIR, scope, os.path.basename(path)))
+
+
+def partial_scope():
+    parts = []
+    letters = frequencyconfig.LETTERS
+    if letters and set(letters) != set(string.ascii_lowercase):
+        parts.append('letters-%s' % ''.join(letters))
+    if frequencyconfig.SAMPLE_RATE is not None:
+        parts.append('sample-%s' % frequencyconfig.SAMPLE_RATE)
+    return '_'.join(parts) or None
+
+
+def _relocate(names, root):
+    for name in names:
+        path = getattr(frequencyconfig, name)
+        if name in INPUT_PATHS:
+            relative = os.path.basename(path)
+        else:
+            relative = os.path.relpath(path, frequencyconfig.PROJECT_ROOT)
+        setattr(frequencyconfig, name, os.path.join(root, relative))
+
+
+def collect_frequencies(stream=None):
+    from processors.frequencycollector import FrequencyCollector
+    from processors.frequencyindexer import index_frequency_files,\
+        accumulate_index
+    if stream is not None:
+        stream.add('index', functools.partial(accumulate_index,
+                                              frequencyconfig.FREQUENCY_DIR))
+    fc = FrequencyCollector(out_dir=frequencyconfig.FREQUENCY_DIR,
+                            full_out_dir=frequencyconfig.FULL_FREQUENCY_DIR,
+                            terse=True, include_subentries=False,
+                            letters=frequencyconfig.LETTERS,
+                            on_letter=stream.publish if stream else None)
+    fc.process()
+
+    index_frequency_files(
+        frequencyconfig.FREQUENCY_DIR,
+        os.path.join(frequencyconfig.FREQUENCY_DIR, 'index.xml'),
+        letters=frequencyconfig.LETTERS,
+        accumulator=stream.result('index') if stream else None,
+    )
+
+
+def letter_consumer(function_name):
+    """
+    Returns the accumulate function of a stage that can consume
+    collect_frequencies' output letter by letter, or None.
+    """
+    if function_name == 'build_csv':
+        from processors.xmltocsv import accumulate_rows
+        return functools.partial(accumulate_rows,
+                                 frequencyconfig.FULL_FREQUENCY_DIR)
+    elif function_name == 'analyse_frequency_data':
+        return _frequency_analysis().accumulate
+    elif function_name == 'band_distributions':
+        return _band_distributions().accumulate
+    elif function_name == 'pos_ratio':
+        return _pos_ratios().accumulate
+    elif function_name == 'raw_currency_data':
+        return _raw_currency_data().accumulate
+    return None
+
+
+def distributed_collect():
+    import multiprocessing
+    from processors import coordinator
+    from processors.frequencyindexer import index_frequency_files
+    letters = frequencyconfig.LETTERS or string.ascii_lowercase
+    queue = coordinator.TaskQueue(frequencyconfig.COORDINATION_DIR)
+    queue.reset()
+    queue.publish(['collect-%s' % letter for letter in letters])
+    print('Published %d tasks to %s' % (len(letters),
+                                         frequencyconfig.COORDINATION_DIR))
+
+    local_workers = [multiprocessing.Process(target=work)
+                     for _ in range(frequencyconfig.LOCAL_WORKERS)]
+    for process in local_workers:
+        process.start()
+    results = coordinator.wait(frequencyconfig.COORDINATION_DIR)
+    for process in local_workers:
+        process.join()
+
+    # Move each letter's output from the staging dir of the worker that
+    #  completed it into the usual layout
+    for task, staging_dir in sorted(results.items()):
+        letter = task.split('-', 1)[1]
+        for out_dir, sub_dir in ((frequencyconfig.FREQUENCY_DIR, 'entry'),
+                                 (frequencyconfig.FULL_FREQUENCY_DIR, 'full')):
+            _replace_dir(os.path.join(staging_dir, sub_dir, letter),
+                         os.path.join(out_dir, letter))
+
+    index_frequency_files(
+        frequencyconfig.FREQUENCY_DIR,
+        os.path.join(frequencyconfig.FREQUENCY_DIR, 'index.xml'),
+        letters=frequencyconfig.LETTERS,
+    )
+
+
+def work():
+    from processors.coordinator import run_worker
+    run_worker(frequencyconfig.COORDINATION_DIR,
+               {'collect': _collect_shard})
+
+
+def _collect_shard(letter, staging_dir):
+    from processors.frequencycollector import FrequencyCollector
+    entry_dir = os.path.join(staging_dir, 'entry')
+    full_dir = os.path.join(staging_dir, 'full')
+    for directory in (entry_dir, full_dir):
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+    fc = FrequencyCollector(out_dir=entry_dir, full_out_dir=full_dir,
+                            terse=True, include_subentries=False,
+                            letters=[letter])
+    fc.process()
+
+
+def _replace_dir(source, destination):
+    if os.path.isdir(destination):
+        shutil.rmtree(destination)
+    parent = os.path.dirname(destination)
+    if not os.path.isdir(parent):
+        os.makedirs(parent)
+    shutil.move(source, destination)
 
 
 def collect_entry_frequencies():
     from processors.frequencycollector import FrequencyCollector
     from processors.frequencyindexer import index_frequency_files
     fc = FrequencyCollector(out_dir=frequencyconfig.FREQUENCY_DIR,
-                            terse=True, include_subentries=False)
+                            terse=True, include_subentries=False,
+                            letters=frequencyconfig.LETTERS)
     fc.process()
 
     index_frequency_files(
         frequencyconfig.FREQUENCY_DIR,
-        os.path.join(frequencyconfig.FREQUENCY_DIR, 'index.xml')
+        os.path.join(frequencyconfig.FREQUENCY_DIR, 'index.xml'),
+        letters=frequencyconfig.LETTERS,
     )
 
 
 def collect_all_frequencies():
     from processors.frequencycollector import FrequencyCollector
     fc = FrequencyCollector(out_dir=frequencyconfig.FULL_FREQUENCY_DIR,
-                            terse=True, include_subentries=True)
+                            terse=True, include_subentries=True,
+                            letters=frequencyconfig.LETTERS)
     fc.process()
 
 
-def build_csv():
+def build_csv(accumulator=None):
     from processors.xmltocsv import xml_to_csv
     xml_to_csv(frequencyconfig.FULL_FREQUENCY_DIR,
-               frequencyconfig.CSV_FILE)
+               frequencyconfig.CSV_FILE,
+               letters=frequencyconfig.LETTERS,
+               accumulator=accumulator)
 
 
-def analyse_frequency_data():
-    from processors.frequencyanalysis import FrequencyAnalysis
-    fa = FrequencyAnalysis(in_dir=frequencyconfig.FREQUENCY_DIR,
-                           out_dir=frequencyconfig.ANALYSIS_DIR,)
-    fa.analyse()
+def build_sqlite():
+    from processors.sqliteexport import SqliteExporter
+    exporter = SqliteExporter(in_dir=frequencyconfig.FULL_FREQUENCY_DIR,
+                              db_file=frequencyconfig.SQLITE_FILE,
+                              letters=frequencyconfig.LETTERS)
+    exporter.build()
+
+
+def analyse_frequency_data(accumulator=None):
+    fa = _frequency_analysis()
+    fa.analyse(accumulator)
     fa.write()
 
 
+def _frequency_analysis():
+    from processors.frequencyanalysis import FrequencyAnalysis
+    return FrequencyAnalysis(in_dir=frequencyconfig.FREQUENCY_DIR,
+                             out_dir=frequencyconfig.ANALYSIS_DIR,
+                             letters=frequencyconfig.LETTERS,
+                             mode=frequencyconfig.ANALYSIS_MODE,
+                             sample_rate=frequencyconfig.SAMPLE_RATE,
+                             processes=frequencyconfig.ANALYSIS_PROCESSES,)
+
+
+def band_distributions(accumulator=None):
+    bd = _band_distributions()
+    bd.count(accumulator)
+    bd.write()
+
+
+def _band_distributions():
+    from processors.banddistribution import BandDistributions
+    return BandDistributions(in_dir=frequencyconfig.FREQUENCY_DIR,
+                             out_dir=frequencyconfig.ANALYSIS_DIR,
+                             letters=frequencyconfig.LETTERS,
+                             processes=frequencyconfig.ANALYSIS_PROCESSES,)
+
+
 def compare_with_oec():
     from processors.frequencyanalysis import OecComparison
     c = OecComparison(in_dir=frequencyconfig.ANALYSIS_DIR,
@@ -58,11 +542,18 @@ def compare_with_oec():
     c.compare()
 
 
-def pos_ratio():
+def pos_ratio(accumulator=None):
+    pr = _pos_ratios()
+    pr.measure_ratios(accumulator)
+
+
+def _pos_ratios():
     from processors.frequencyanalysis import PosRatios
-    pr = PosRatios(in_dir=frequencyconfig.FREQUENCY_DIR,
-                   out_dir=frequencyconfig.ANALYSIS_DIR,)
-    pr.measure_ratios()
+    return PosRatios(in_dir=frequencyconfig.FREQUENCY_DIR,
+                     out_dir=frequencyconfig.ANALYSIS_DIR,
+                     letters=frequencyconfig.LETTERS,
+                     sample_rate=frequencyconfig.SAMPLE_RATE,
+                     processes=frequencyconfig.ANALYSIS_PROCESSES,)
 
 
 def rank_entries():
@@ -70,29 +561,54 @@ def rank_entries():
     store_rankings()
 
 
-def raw_currency_data():
-    from processors.currency import RawCurrencyData
-    c = RawCurrencyData(in_dir=frequencyconfig.FREQUENCY_DIR)
-    c.build_currency_data()
+def raw_currency_data(accumulator=None):
+    c = _raw_currency_data()
+    c.build_currency_data(accumulator)
     c.write(os.path.join(frequencyconfig.CURRENCY_DIR, 'source_raw.csv'))
 
 
+def _raw_currency_data():
+    from processors.currency import RawCurrencyData
+    return RawCurrencyData(in_dir=frequencyconfig.FREQUENCY_DIR,
+                           letters=frequencyconfig.LETTERS,
+                           sample_rate=frequencyconfig.SAMPLE_RATE,
+                           processes=frequencyconfig.ANALYSIS_PROCESSES)
+
+
 def estimate_currency():
     from processors.currency import CurrencyEvaluator
     c = CurrencyEvaluator(
         in_file=os.path.join(frequencyconfig.CURRENCY_DIR, 'source_raw.csv'),
+        sample_rate=frequencyconfig.SAMPLE_RATE,
     )
     c.read()
     c.write(os.path.join(frequencyconfig.CURRENCY_DIR, 'source.csv'))
+    if frequencyconfig.SAMPLE_RATE is not None:
+        c.write_estimates(os.path.join(frequencyconfig.CURRENCY_DIR,
+                                       'source_estimates.csv'))
 
 
-def estimate_currency():
-    from processors.currency import CurrencyEvaluator
-    c = CurrencyEvaluator(
+def currency_sweep():
+    from processors.currency import CurrencySweep
+    c = CurrencySweep(
         in_file=os.path.join(frequencyconfig.CURRENCY_DIR, 'source_raw.csv'),
+        grid=frequencyconfig.CURRENCY_SWEEP,
     )
-    c.read()
-    c.write(os.path.join(frequencyconfig.CURRENCY_DIR, 'source.csv'))
+    c.sweep()
+    c.write(os.path.join(frequencyconfig.CURRENCY_DIR, 'sweep.csv'))
+
+
+def diff_builds():
+    from processors.frequencydiff import FrequencyDiff
+    diff = FrequencyDiff(old=frequencyconfig.PREVIOUS_BUILD,
+                         new=frequencyconfig.FULL_FREQUENCY_DIR,
+                         threshold=frequencyconfig.DIFF_THRESHOLD,
+                         letters=frequencyconfig.LETTERS)
+    if not os.path.isdir(frequencyconfig.DIFF_DIR):
+        os.makedirs(frequencyconfig.DIFF_DIR)
+    diff.compare(os.path.join(frequencyconfig.DIFF_DIR, 'changes.csv'))
+    diff.write_summary(os.path.join(frequencyconfig.DIFF_DIR, 'summary.csv'))
+    diff.print_summary()
 
 
 def ranksample():
@@ -100,4 +616,10 @@ def ranksample():
     rank_list(os.path.join(frequencyconfig.ANALYSIS_DIR, 'ranksample.txt'))
 
 if __name__ == '__main__':
-    dispatch()
+    options = configure()
+    if options.dry_run:
+        print_plan()
+    elif options.worker:
+        work()
+    else:
+        dispatch()
@@ -0,0 +1,210 @@
+"""
+BandDistributions - Period x band distributions of frequency tables, at
+entry, wordclass-set, and type level
+
+Bands are assigned in bulk: frequencies are gathered into arrays, and
+looked up in a sorted table of band boundaries with numpy.searchsorted,
+so computing bands for every period costs little more than reading the
+frequencies.
+
+As a check that the table agrees with FrequencyTable.band(), the bands
+of the first CHECK_SIZE frequencies, and of any frequency that's zero or
+falls on a band boundary, are also looked up with FrequencyTable.band();
+a disagreement raises ValueError.
+"""
+
+import os
+import csv
+from array import array
+
+import numpy
+
+from lex.frequencytable import band_limits
+from processors.frequencyreader import frequency_iterator
+from processors.profiling import profile_entries
+from processors.shards import map_reduce
+
+LEVELS = ('entries', 'wordclass_sets', 'types')
+BATCH_SIZE = 100000  # frequencies gathered before bands are assigned
+CHECK_SIZE = 10000  # frequencies checked against FrequencyTable.band()
+
+
+class BandTable(object):
+
+    """
+    band_limits(mode='dictionary') as a sorted table of lower frequency
+    limits. Each band's limits are (lower, upper, label); a frequency
+    falls in the band with the highest lower limit that doesn't exceed
+    it, and frequencies below every limit fall in the lowest band.
+    """
+
+    def __init__(self, limits=None):
+        if limits is None:
+            limits = band_limits(mode='dictionary')
+        ordered = sorted(limits.items(), key=lambda item: item[1][0])
+        self.bands = numpy.array([band for band, _ in ordered], dtype=int)
+        self.lower = numpy.array([l[0] for _, l in ordered], dtype=float)
+        self.labels = {band: l[2] for band, l in ordered}
+        self.boundaries = set([0])
+        for _, l in ordered:
+            self.boundaries.update([value for value in l[:2]
+                                    if value is not None])
+
+    def assign(self, frequencies):
+        """
+        Returns an array of the bands of an array of frequencies.
+        """
+        positions = numpy.searchsorted(self.lower, frequencies,
+                                       side='right') - 1
+        return self.bands[numpy.maximum(positions, 0)]
+
+    def columns(self):
+        """
+        Bands in column order (most frequent first).
+        """
+        return sorted(self.bands.tolist())
+
+
+class BandDistributions(object):
+
+    """
+    Counts the frequency tables falling in each band, for each period,
+    and writes a .csv file for each level (entries, wordclass sets and
+    types). Periods missing from a frequency table aren't counted.
+    """
+
+    def __init__(self, **kwargs):
+        self.in_dir = kwargs.get('in_dir')
+        self.out_dir = kwargs.get('out_dir')
+        self.letters = kwargs.get('letters')
+        self.processes = kwargs.get('processes', 0)
+        self.counts = None
+
+    def count(self, accumulator=None):
+        if accumulator is None:
+            accumulator = map_reduce(self.accumulate, self.letters,
+                                     self.processes)
+        self.counts = accumulator.finalize()
+
+    def accumulate(self, letters):
+        accumulator = BandAccumulator(BandTable())
+        iterator = frequency_iterator(in_dir=self.in_dir,
+                                      letters=letters,
+                                      message='Counting band distributions')
+        for e in profile_entries(iterator.iterate()):
+            accumulator.update(e)
+        return accumulator
+
+    def write(self):
+        table = BandTable()
+        bands = table.columns()
+        for level in LEVELS:
+            filepath = os.path.join(self.out_dir,
+                                    'band_distribution_%s.csv' % level)
+            with open(filepath, 'w') as csvfile:
+                csvw = csv.writer(csvfile)
+                csvw.writerow(['period'] + bands)
+                csvw.writerow(['range'] + [table.labels[b] for b in bands])
+                for period in sorted(self.counts[level].keys()):
+                    csvw.writerow([period] +
+                                  self.counts[level][period].tolist())
+
+
+class BandAccumulator(object):
+
+    """
+    Period x band counts for a shard of entries. Frequencies are
+    buffered, and binned into bands BATCH_SIZE at a time.
+    """
+
+    def __init__(self, table):
+        self.table = table
+        bands = table.columns()
+        # band number -> column
+        self.lookup = numpy.zeros(max(bands) + 1, dtype=int)
+        self.lookup[bands] = numpy.arange(len(bands))
+        self.width = len(bands)
+        self.counts = {level: {} for level in LEVELS}
+        self.periods = []
+        self.period_index = {}
+        self.pending = {level: (array('i'), array('d')) for level in LEVELS}
+        self.size = 0
+        # Frequencies, and their bands according to FrequencyTable.band(),
+        #  to check table.assign() against
+        self.checks = (array('d'), array('i'))
+        self.checked = 0
+
+    def update(self, e):
+        self.add('entries', e.frequency_table())
+        for wcs in e.wordclass_sets():
+            self.add('wordclass_sets', wcs.frequency_table())
+            for type_unit in wcs.types():
+                self.add('types', type_unit.frequency_table())
+        if self.size >= BATCH_SIZE:
+            self.flush()
+
+    def add(self, level, ft):
+        if ft is None:
+            return
+        periods, frequencies = self.pending[level]
+        for p in ft.data.keys():
+            if p not in self.period_index:
+                self.period_index[p] = len(self.periods)
+                self.periods.append(p)
+            periods.append(self.period_index[p])
+            frequency = ft.frequency(period=p)
+            frequencies.append(frequency)
+            if (self.checked < CHECK_SIZE or
+                    frequency in self.table.boundaries):
+                self.checks[0].append(frequency)
+                self.checks[1].append(ft.band(period=p))
+                self.checked += 1
+        self.size += len(ft.data)
+
+    def flush(self):
+        self.check()
+        width = self.width
+        for level in LEVELS:
+            periods, frequencies = self.pending[level]
+            if not len(periods):
+                continue
+            bands = self.table.assign(numpy.frombuffer(frequencies))
+            cells = (numpy.frombuffer(periods, dtype=numpy.intc) * width +
+                     self.lookup[bands])
+            binned = numpy.bincount(cells, minlength=len(self.periods) *
+                                    width).reshape(-1, width)
+            for i, p in enumerate(self.periods):
+                if binned[i].any():
+                    self.add_counts(level, p, binned[i])
+            self.pending[level] = (array('i'), array('d'))
+        self.size = 0
+
+    def check(self):
+        frequencies, expected = self.checks
+        if not len(frequencies):
+            return
+        assigned = self.table.assign(numpy.frombuffer(frequencies))
+        expected = numpy.frombuffer(expected, dtype=numpy.intc)
+        for i in numpy.flatnonzero(assigned != expected)[:1]:
+            raise ValueError('Frequency %r assigned to band %d, but '
+                             'FrequencyTable.band() gives %d' %
+                             (frequencies[i], assigned[i], expected[i]))
+        self.checks = (array('d'), array('i'))
+
+    def add_counts(self, level, period, counts):
+        if period in self.counts[level]:
+            self.counts[level][period] += counts
+        else:
+            self.counts[level][period] = counts.copy()
+
+    def merge(self, other):
+        other.flush()
+        self.flush()
+        for level in LEVELS:
+            for period, counts in other.counts[level].items():
+                self.add_counts(level, period, counts)
+        return self
+
+    def finalize(self):
+        self.flush()
+        return self.counts
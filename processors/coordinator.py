@@ -0,0 +1,340 @@
+"""
+coordinator -- file-based task queue for sharing work between hosts
+
+The queue lives in a coordination directory on a filesystem shared by
+all hosts (e.g. an NFS mount):
+
+    tasks                     list of tasks published (written last, so
+                              workers wait until it exists)
+    pending/<task>            tasks waiting to be claimed
+    claimed/<task>.<worker>   tasks being worked on, and by whom
+    done/<task>.<worker>      completed tasks, and who completed them
+    failed/<task>             tasks given up on, with the last error
+    staging/<task>.<worker>/  output written by a worker
+
+Each task is a single file, holding its attempt count and last error,
+which is only ever moved from one state to the next by renaming it.
+Rename is atomic, so only one worker can claim a pending task, and when
+a worker's lease runs out just as it finishes, either the worker
+completes the task or the task goes back to pending -- never both.
+Because each attempt writes to its own staging dir, output from an
+abandoned attempt never gets mixed up with the attempt that completes.
+
+Workers renew their lease on a task while they work by touching the
+claimed file; tasks whose lease has expired (e.g. because the host
+died) are moved back to pending/ and picked up by another worker. Lease
+times are taken from the change times of files in the coordination
+directory, which on NFS are set by the server's clock, so the hosts'
+own clocks needn't agree. (On a filesystem that takes timestamps from
+the client, hosts' clocks need to agree to well within LEASE.)
+
+A task that fails (the handler raises an error, or its lease expires)
+is retried until it has been attempted MAX_ATTEMPTS times, and then
+moved to failed/. A worker carries on with other tasks after a failure.
+
+Task names take the form <kind>-<shard>, e.g. 'collect-q'; workers are
+given a handler for each kind, which is called with the shard and a
+staging dir to write into.
+"""
+
+import os
+import json
+import time
+import shutil
+import socket
+import threading
+import traceback
+
+LEASE = 600  # seconds before an unrenewed claim expires
+HEARTBEAT = 60  # seconds between lease renewals
+POLL = 5  # seconds between checks for new or finished tasks
+MAX_ATTEMPTS = 3  # attempts at a task before it's given up on
+
+
+class TaskFailure(Exception):
+
+    def __init__(self, failures):
+        self.failures = failures
+        super(TaskFailure, self).__init__(
+            '%d task(s) failed: %s' % (len(failures),
+                                       ', '.join(sorted(failures))))
+
+
+class TaskQueue(object):
+
+    def __init__(self, coord_dir, lease=LEASE, max_attempts=MAX_ATTEMPTS):
+        self.coord_dir = coord_dir
+        self.lease = lease
+        self.max_attempts = max_attempts
+
+    def path(self, *parts):
+        return os.path.join(self.coord_dir, *parts)
+
+    def reset(self):
+        """
+        Clear out any previous run, and set up an empty queue.
+        """
+        if os.path.isdir(self.coord_dir):
+            shutil.rmtree(self.coord_dir)
+        for sub_dir in ('pending', 'claimed', 'done', 'failed', 'staging'):
+            os.makedirs(self.path(sub_dir))
+
+    def publish(self, tasks):
+        for task in tasks:
+            _write_atomic(self.path('pending', task),
+                          json.dumps({'attempts': 0, 'error': None}))
+        _write_atomic(self.path('tasks'), '\n'.join(tasks))
+
+    def tasks(self):
+        try:
+            with open(self.path('tasks')) as filehandle:
+                return filehandle.read().split()
+        except FileNotFoundError:
+            return None
+
+    def claimed_path(self, task, worker_id):
+        return self.path('claimed', '%s.%s' % (task, worker_id))
+
+    def claim(self, worker_id):
+        self.reclaim_expired()
+        for task in sorted(os.listdir(self.path('pending'))):
+            if task.startswith('.'):
+                continue
+            claimed_path = self.claimed_path(task, worker_id)
+            try:
+                os.rename(self.path('pending', task), claimed_path)
+            except FileNotFoundError:
+                # another worker got there first
+                continue
+            state = _read_state(claimed_path)
+            if state is None:
+                continue
+            state['attempts'] += 1
+            if state['attempts'] > self.max_attempts:
+                # Its previous attempt's lease expired
+                state['error'] = state['error'] or 'lease expired'
+                self.finish(task, worker_id, state, 'failed')
+                continue
+            _update_state(claimed_path, state)
+            return task
+        return None
+
+    def renew(self, task, worker_id):
+        """
+        Extend the worker's lease on the task. Returns False if the lease
+        has been lost.
+        """
+        try:
+            os.utime(self.claimed_path(task, worker_id))
+        except FileNotFoundError:
+            return False
+        return True
+
+    def complete(self, task, worker_id):
+        """
+        Mark the task as done; its result is the worker's staging dir.
+        Returns False if the worker's lease was lost in the meantime, in
+        which case the result should be discarded.
+        """
+        try:
+            os.rename(self.claimed_path(task, worker_id),
+                      self.path('done', '%s.%s' % (task, worker_id)))
+        except FileNotFoundError:
+            return False
+        return True
+
+    def release(self, task, worker_id, error):
+        """
+        Give up a claimed task after an error, so that another worker can
+        retry it (or mark it as failed, if it's been tried MAX_ATTEMPTS
+        times).
+        """
+        state = _read_state(self.claimed_path(task, worker_id))
+        if state is None:
+            return
+        state['error'] = error
+        if state['attempts'] >= self.max_attempts:
+            self.finish(task, worker_id, state, 'failed')
+        else:
+            self.finish(task, worker_id, state, 'pending')
+
+    def finish(self, task, worker_id, state, sub_dir):
+        claimed_path = self.claimed_path(task, worker_id)
+        if not _update_state(claimed_path, state):
+            return
+        try:
+            os.rename(claimed_path, self.path(sub_dir, task))
+        except FileNotFoundError:
+            pass
+
+    def reclaim_expired(self):
+        now = self.now()
+        for filename in os.listdir(self.path('claimed')):
+            if filename.startswith('.'):
+                continue
+            try:
+                claimed = os.stat(self.path('claimed', filename))
+            except FileNotFoundError:
+                continue
+            if claimed.st_ctime + self.lease < now:
+                task = filename.split('.', 1)[0]
+                try:
+                    os.rename(self.path('claimed', filename),
+                              self.path('pending', task))
+                except FileNotFoundError:
+                    pass
+
+    def now(self):
+        """
+        The current time by the coordination directory's clock (the
+        change time of a file touched just now), so that it can be
+        compared with the change times of claimed files.
+        """
+        clock = self.path('.clock.%s' % worker_id())
+        with open(clock, 'w'):
+            pass
+        return os.stat(clock).st_ctime
+
+    def results(self):
+        results = {}
+        for filename in os.listdir(self.path('done')):
+            if not filename.startswith('.'):
+                task = filename.split('.', 1)[0]
+                results[task] = self.path('staging', filename)
+        return results
+
+    def failures(self):
+        failures = {}
+        for task in os.listdir(self.path('failed')):
+            if not task.startswith('.'):
+                state = _read_state(self.path('failed', task))
+                failures[task] = state['error'] if state else None
+        return failures
+
+    def is_finished(self):
+        tasks = self.tasks()
+        if tasks is None:
+            return False
+        return set(tasks) <= (set(self.results().keys()) |
+                              set(self.failures().keys()))
+
+
+class Heartbeat(object):
+
+    """
+    Renews a worker's lease on a task at regular intervals, for as long
+    as the task is being worked on.
+    """
+
+    def __init__(self, queue, task, worker_id, interval=HEARTBEAT):
+        self.queue = queue
+        self.task = task
+        self.worker_id = worker_id
+        self.interval = interval
+        self.halt = threading.Event()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *args):
+        self.halt.set()
+        self.thread.join()
+
+    def run(self):
+        while not self.halt.wait(self.interval):
+            if not self.queue.renew(self.task, self.worker_id):
+                return
+
+
+def worker_id():
+    return '%s-%d' % (socket.gethostname(), os.getpid())
+
+
+def run_worker(coord_dir, handlers, poll=POLL, lease=LEASE,
+               heartbeat=HEARTBEAT, max_attempts=MAX_ATTEMPTS):
+    """
+    Claim and run tasks until every published task is done or has
+    failed.
+
+    handlers maps each kind of task to a function taking the shard and
+    a staging dir. An error raised by a handler is reported, and the
+    task released for another attempt; the worker carries on.
+    """
+    queue = TaskQueue(coord_dir, lease=lease, max_attempts=max_attempts)
+    identifier = worker_id()
+    while not os.path.isdir(queue.path('pending')) or queue.tasks() is None:
+        time.sleep(poll)
+
+    while not queue.is_finished():
+        task = queue.claim(identifier)
+        if task is None:
+            time.sleep(poll)
+            continue
+        kind, shard = task.split('-', 1)
+        staging_dir = queue.path('staging', '%s.%s' % (task, identifier))
+        print('%s: running %s...' % (identifier, task))
+        try:
+            with Heartbeat(queue, task, identifier, interval=heartbeat):
+                handlers[kind](shard, staging_dir)
+        except Exception:
+            error = traceback.format_exc()
+            print('%s: %s failed\n%s' % (identifier, task, error))
+            queue.release(task, identifier, error)
+            shutil.rmtree(staging_dir, ignore_errors=True)
+            continue
+        if not queue.complete(task, identifier):
+            print('%s: lease on %s lost; discarding output' %
+                  (identifier, task))
+            shutil.rmtree(staging_dir, ignore_errors=True)
+
+
+def wait(coord_dir, poll=POLL, lease=LEASE, max_attempts=MAX_ATTEMPTS):
+    """
+    Wait until every published task is done or has failed (reassigning
+    any tasks whose lease expires meanwhile), and return the results.
+    Raises TaskFailure, listing the failed tasks' last errors, if any
+    failed.
+    """
+    queue = TaskQueue(coord_dir, lease=lease, max_attempts=max_attempts)
+    while not queue.is_finished():
+        queue.reclaim_expired()
+        time.sleep(poll)
+    failures = queue.failures()
+    if failures:
+        for task, error in sorted(failures.items()):
+            print('%s failed:\n%s' % (task, error))
+        raise TaskFailure(failures)
+    return queue.results()
+
+
+def _read_state(filepath):
+    try:
+        with open(filepath) as filehandle:
+            return json.load(filehandle)
+    except (FileNotFoundError, ValueError):
+        return None
+
+
+def _update_state(filepath, state):
+    """
+    Rewrite a task file in place (it mustn't be recreated if it's been
+    moved on meanwhile). Returns False if it no longer exists.
+    """
+    try:
+        with open(filepath, 'r+') as filehandle:
+            filehandle.truncate()
+            filehandle.write(json.dumps(state))
+    except FileNotFoundError:
+        return False
+    return True
+
+
+def _write_atomic(filepath, content):
+    tmp_path = os.path.join(os.path.dirname(filepath),
+                            '.%s.%s' % (os.path.basename(filepath),
+                                        worker_id()))
+    with open(tmp_path, 'w') as filehandle:
+        filehandle.write(content)
+    os.replace(tmp_path, filepath)
@@ -4,9 +4,16 @@ Currency
 
 import math
 import csv
+import itertools
+
+import numpy
 
 from lex.oed.resources.vitalstatistics import VitalStatisticsCache
-from lex.oed.resources.frequencyiterator import FrequencyIterator
+from processors.frequencyreader import frequency_iterator
+from processors.profiling import profile_entries
+from processors.shards import map_reduce, resource
+from processors.sampling import in_sample, sample_entries, estimate_count,\
+    estimate_totals, estimate_statistics
 import frequencyconfig
 
 
@@ -29,20 +36,31 @@ class RawCurrencyData(object):
         'suffixes1': ['-' + j for j in
                       frequencyconfig.LOGICAL_CURRENCY_SUFFIXES1.split('|')],
         'suffixes2': ['-' + j for j in
-                      frequencyconfig.LOGICAL_CURRENCY_SUFFIXES1.split('|')],
+                      frequencyconfig.LOGICAL_CURRENCY_SUFFIXES2.split('|')],
     }
 
     def __init__(self, **kwargs):
         self.in_dir = kwargs.get('in_dir')
+        self.letters = kwargs.get('letters')
+        self.sample_rate = kwargs.get('sample_rate')
+        # if more than 1, letters are processed in parallel (see
+        #  processors.shards)
+        self.processes = kwargs.get('processes', 0)
 
-    def build_currency_data(self):
-        self.vs = VitalStatisticsCache()
-        iterator = FrequencyIterator(in_dir=self.in_dir,
-                                     letters=None,
-                                     message='Getting data')
-        self.candidates = []
-        self.candidates.append(list(RawCurrencyData.headers))
-        for e in iterator.iterate():
+    def build_currency_data(self, accumulator=None):
+        if accumulator is None:
+            accumulator = map_reduce(self.accumulate, self.letters,
+                                     self.processes)
+        self.candidates = accumulator.finalize()
+
+    def accumulate(self, letters):
+        self.vs = resource(VitalStatisticsCache)
+        accumulator = CandidateAccumulator()
+        iterator = frequency_iterator(in_dir=self.in_dir,
+                                      letters=letters,
+                                      message='Getting data')
+        for e in sample_entries(profile_entries(iterator.iterate()),
+                                self.sample_rate):
             if (e.end and
                     e.end >= RawCurrencyData.start and
                     e.end <= RawCurrencyData.end and
@@ -78,7 +96,8 @@ class RawCurrencyData(object):
                 ]
                 row.extend(['%0.2g' % f for f in freqs])
                 row.append('%0.2g' % delta)
-                self.candidates.append(tuple(row))
+                accumulator.update(tuple(row))
+        return accumulator
 
     def is_logically_current(self, e):
         etyma = self.vs.find(e.id, field='etyma')
@@ -124,13 +143,65 @@ class RawCurrencyData(object):
         return d
 
 
+class CandidateAccumulator(object):
+
+    """
+    Partial RawCurrencyData results for a shard of entries: candidate
+    rows, in entry order.
+    """
+
+    def __init__(self):
+        self.rows = []
+
+    def update(self, row):
+        self.rows.append(row)
+
+    def merge(self, other):
+        self.rows.extend(other.rows)
+        return self
+
+    def finalize(self):
+        return [list(RawCurrencyData.headers)] + self.rows
+
+
 class CurrencyEvaluator(object):
 
+    # weights and thresholds used by estimate_currency(); any of these
+    #  can be overridden by passing a 'parameters' dict to the constructor
+    parameters = {
+        'delta_cap': 5,
+        'pro_base': 2,
+        'logical_high': 7,
+        'logical_low': 3,
+        'odo_linked': 9,
+        'technical': 2,
+        'recent_date': 1900,
+        'recent_date_weight': 0.1,
+        'high_frequency': 0.1,
+        'high_frequency_weight': 10,
+        'large_size': 4,
+        'decrease_weight': 0.5,
+        'low_frequency': 0.002,
+        'low_frequency_floor': 0.0001,
+        'early_date': 1850,
+        'early_date_weight': 0.07,
+        'obs_full': 10,
+        'obs_queried': 6,
+        'obs_partial': 2,
+    }
+
     def __init__(self, **kwargs):
         self.in_file = kwargs.get('in_file')
+        self.parameters = _merge_parameters(kwargs.get('parameters'))
+        # Fraction of entries sampled when the raw data was built (if
+        #  any), used to scale estimates up to the whole dictionary. Only
+        #  rows for entries in the sample count towards the estimates,
+        #  in case the raw data wasn't actually sampled.
+        self.sample_rate = kwargs.get('sample_rate')
 
     def read(self):
         self.output = []
+        self.scores = []
         with open(self.in_file, 'r') as csvfile:
             csvw = csv.reader(csvfile)
             for i, row in enumerate(csvw):
@@ -148,6 +219,9 @@ class CurrencyEvaluator(object):
                     pro_score, pro_reason, anti_score, anti_reason,\
                         delta_score, log_weighted_size, obs_label =\
                         self.estimate_currency(d)
+                    if (self.sample_rate is None or
+                            in_sample(row[0], self.sample_rate)):
+                        self.scores.append((pro_score, anti_score))
                     row2 = row[:]
                     row2.insert(12, '%0.2g' % log_weighted_size)
                     row2.extend(('%0.2g' % delta_score,
@@ -164,22 +238,42 @@ class CurrencyEvaluator(object):
             csvw = csv.writer(csvfile)
             csvw.writerows(self.output)
 
-    def estimate_currency(self, d):
-        for j in ('start', 'end', 'quotations', 'weighted size',
-                  '1800-49', '1850-99', '1900-49', '1950-99', '2000-',
-                  'frequency change'):
-            d[j] = float(d[j])
-        for j in ('ODO-linked', 'logically current'):
-            if d[j].lower() == 'true':
-                d[j] = True
-            else:
-                d[j] = False
+    def write_estimates(self, filepath):
+        """
+        Write estimates of score distributions, and of the number of
+        current entries (pro score greater than anti score) in the whole
+        dictionary, with confidence intervals.
+        """
+        scores = numpy.array(self.scores, dtype=float).reshape(-1, 2)
+        pro, anti = scores[:, 0], scores[:, 1]
+        rows = [('statistic', 'estimate', 'low', 'high')]
+
+        rate = self.sample_rate or 1
+        current = estimate_totals((pro > anti)[:, None], rate)
+        for name, (estimate, low, high) in (
+                ('entries', estimate_count(len(pro), rate)),
+                ('current', [v[0] for v in current])):
+            rows.append((name, int(round(estimate)), int(round(low)),
+                         int(round(high))))
 
-        delta_score = d['frequency change']
-        if delta_score < -5:
-            delta_score = -5 - math.log(abs(delta_score))
-        if delta_score > 5:
-            delta_score = 5 + math.log(abs(delta_score))
+        statistics = {'mean': numpy.mean}
+        for pc in (10, 50, 90):
+            statistics['p%d' % pc] = lambda v, pc=pc: numpy.percentile(v, pc)
+        for score, values in (('pro', pro), ('anti', anti),
+                              ('diff', pro - anti)):
+            for name, estimate, low, high in estimate_statistics(values,
+                                                                 statistics):
+                rows.append(('%s %s' % (score, name), '%0.3g' % estimate,
+                             '%0.3g' % low, '%0.3g' % high))
+
+        with open(filepath, 'w') as csvfile:
+            csvw = csv.writer(csvfile)
+            csvw.writerows(rows)
+
+    def estimate_currency(self, d):
+        p = self.parameters
+        _parse_row(d)
+        delta_score = _delta_score(d['frequency change'], p['delta_cap'])
 
         if d['weighted size'] == 0:
             log_weighted_size = 0
@@ -188,53 +282,47 @@ class CurrencyEvaluator(object):
 
         pro = {}
         if d['logically current'] == 'high':
-            pro['logical currency'] = 7
+            pro['logical currency'] = p['logical_high']
         if d['logically current'] == 'low':
-            pro['logical currency'] = 3
+            pro['logical currency'] = p['logical_low']
         if d['ODO-linked']:
-            pro['linked to ODE/NOAD'] = 9
+            pro['linked to ODE/NOAD'] = p['odo_linked']
         if d['subject']:
-            pro['technical/specialist'] = 2
-        if d['end'] and d['end'] > 1900:
-            pro['last date'] = float(d['end'] - 1900) * 0.1
+            pro['technical/specialist'] = p['technical']
+        if d['end'] and d['end'] > p['recent_date']:
+            pro['last date'] = (float(d['end'] - p['recent_date']) *
+                                p['recent_date_weight'])
         #if delta_score > 1:
         #    pro['increase in frequency'] = abs(delta_score)
-        if d['1950-99'] > 0.1:
-            pro['high frequency'] = 10 * d['1950-99']
-        if d['weighted size'] >= 4:
+        if d['1950-99'] > p['high_frequency']:
+            pro['high frequency'] = p['high_frequency_weight'] * d['1950-99']
+        if d['weighted size'] >= p['large_size']:
             pro['entry size'] = log_weighted_size
 
         anti= {}
         if delta_score < 0 and d['1950-99'] < 1:
-            anti['decrease in frequency'] = abs(delta_score) * 0.5
-        if d['1950-99'] < 0.0001:
-            anti['low frequency'] = 0.002 / 0.0001
-        elif d['1950-99'] < 0.002:
-            anti['low frequency'] = 0.002 / d['1950-99']
-        if d['end'] and d['end'] < 1850:
-            anti['last date'] = float(1850 - d['end']) * 0.07
+            anti['decrease in frequency'] = (abs(delta_score) *
+                                             p['decrease_weight'])
+        if d['1950-99'] < p['low_frequency_floor']:
+            anti['low frequency'] = (p['low_frequency'] /
+                                     p['low_frequency_floor'])
+        elif d['1950-99'] < p['low_frequency']:
+            anti['low frequency'] = p['low_frequency'] / d['1950-99']
+        if d['end'] and d['end'] < p['early_date']:
+            anti['last date'] = (float(p['early_date'] - d['end']) *
+                                 p['early_date_weight'])
         if d['weighted size'] < 1 and d['weighted size'] > 0:
             anti['entry size'] = abs(log_weighted_size)
 
-        if d['header'] == 'Obs.':
-            anti['header text'] = 10
-            obs_label = 'full'
-        elif d['header'] == '? Obs.' or d['header'] == '?Obs.':
-            anti['header text'] = 6
-            obs_label = 'queried'
-        elif ('nonce' in d['header'].lower() or
-                'now rare' in d['header'].lower() or
-                'Obs' in d['header']):
-            anti['header text'] = 2
-            obs_label = 'partial'
-        else:
-            obs_label = None
+        obs_label = _obs_label(d['header'])
+        if obs_label is not None:
+            anti['header text'] = p['obs_' + obs_label]
 
         if pro:
-            pro_score = 2 + sum([v for v in pro.values()])
+            pro_score = p['pro_base'] + sum([v for v in pro.values()])
             pro_reason = max(pro.keys(), key=lambda k: pro[k])
         else:
-            pro_score = 2
+            pro_score = p['pro_base']
             pro_reason = ''
 
         if anti:
@@ -246,3 +334,208 @@ class CurrencyEvaluator(object):
 
         return (pro_score, pro_reason, anti_score, anti_reason,
                 delta_score, log_weighted_size, obs_label)
+
+
+class CurrencySweep(object):
+
+    """
+    Evaluates a grid of CurrencyEvaluator parameter sets against the
+    raw currency data in a single load.
+
+    Each parameter set is scored across all candidates at once using
+    numpy arrays, and compared against the default parameters to count
+    how many entries change classification (current = pro score
+    greater than anti score).
+
+    The grid is a dict mapping parameter names to lists of values; every
+    combination is evaluated. As well as the CurrencyEvaluator parameters,
+    'range_start' and 'range_end' can be used to narrow the range of
+    last dates evaluated (but not to widen it beyond the range used when
+    the raw currency data was built).
+
+    The LOGICAL_CURRENCY_* settings decide which entries are marked as
+    logically current ('high' or 'low') when the raw currency data is
+    built, so they can't be swept; varying them means rebuilding
+    source_raw.csv (raw_currency_data). The weights given to the two
+    tiers ('logical_high' and 'logical_low') can be.
+    """
+
+    scores = ('pro', 'anti', 'diff')
+    percentiles = (10, 50, 90)
+
+    def __init__(self, **kwargs):
+        self.in_file = kwargs.get('in_file')
+        self.grid = kwargs.get('grid') or {}
+
+    def load(self):
+        rows = []
+        with open(self.in_file, 'r') as csvfile:
+            for d in csv.DictReader(csvfile):
+                rows.append(_parse_row(d))
+
+        def column(func, dtype=float):
+            return numpy.array([func(d) for d in rows], dtype=dtype)
+
+        self.table = {
+            'end': column(lambda d: d['end']),
+            'frequency': column(lambda d: d['1950-99']),
+            'weighted_size': column(lambda d: d['weighted size']),
+            'frequency_change': column(lambda d: d['frequency change']),
+            'odo_linked': column(lambda d: d['ODO-linked'], bool),
+            'technical': column(lambda d: bool(d['subject']), bool),
+            'logical_high': column(lambda d: d['logically current'] == 'high',
+                                   bool),
+            'logical_low': column(lambda d: d['logically current'] == 'low',
+                                  bool),
+            'obs_label': column(lambda d: _obs_label(d['header']) or '',
+                                object),
+        }
+        size = self.table['weighted_size']
+        with numpy.errstate(divide='ignore'):
+            self.table['log_weighted_size'] = numpy.where(
+                size == 0, 0, numpy.log(numpy.where(size > 0, size, 1)))
+
+    def parameter_sets(self):
+        names = sorted(self.grid.keys())
+        for values in itertools.product(*[self.grid[n] for n in names]):
+            yield dict(zip(names, values))
+
+    def sweep(self):
+        self.load()
+        baseline = self.evaluate({})
+        baseline_current = baseline['pro'] > baseline['anti']
+
+        names = sorted(self.grid.keys())
+        self.output = [self.headers(names)]
+        for parameter_set in self.parameter_sets():
+            scores = self.evaluate(parameter_set)
+            mask = scores['mask']
+            current = (scores['pro'] > scores['anti'])[mask]
+            changed = current != baseline_current[mask]
+
+            row = [parameter_set[n] for n in names]
+            row.extend((int(mask.sum()), int(current.sum()),
+                        int(changed.sum())))
+            for score in CurrencySweep.scores:
+                values = scores[score][mask]
+                if len(values):
+                    row.append('%0.3g' % values.mean())
+                    row.extend(['%0.3g' % v for v in numpy.percentile(
+                        values, CurrencySweep.percentiles)])
+                else:
+                    row.extend([''] * (len(CurrencySweep.percentiles) + 1))
+            self.output.append(row)
+
+    def headers(self, names):
+        headers = list(names)
+        headers.extend(('entries', 'current', 'changed'))
+        for score in CurrencySweep.scores:
+            headers.append('%s mean' % score)
+            headers.extend(['%s p%d' % (score, pc)
+                            for pc in CurrencySweep.percentiles])
+        return headers
+
+    def evaluate(self, parameter_set):
+        """
+        Vectorised equivalent of CurrencyEvaluator.estimate_currency(),
+        returning arrays of pro, anti, and diff scores, plus a mask of
+        entries within the parameter set's date range.
+        """
+        parameter_set = dict(parameter_set)
+        range_start = parameter_set.pop('range_start',
+                                        frequencyconfig.RANGE_START)
+        range_end = parameter_set.pop('range_end', frequencyconfig.RANGE_END)
+        p = _merge_parameters(parameter_set)
+        t = self.table
+        end = t['end']
+        frequency = t['frequency']
+        size = t['weighted_size']
+        log_size = t['log_weighted_size']
+
+        delta_score = t['frequency_change'].copy()
+        cap = p['delta_cap']
+        with numpy.errstate(divide='ignore'):
+            log_delta = numpy.log(numpy.abs(delta_score))
+        delta_score = numpy.where(delta_score < -cap, -cap - log_delta,
+                                  delta_score)
+        delta_score = numpy.where(delta_score > cap, cap + log_delta,
+                                  delta_score)
+
+        pro = numpy.full(len(end), float(p['pro_base']))
+        pro += numpy.where(t['logical_high'], p['logical_high'], 0)
+        pro += numpy.where(t['logical_low'], p['logical_low'], 0)
+        pro += numpy.where(t['odo_linked'], p['odo_linked'], 0)
+        pro += numpy.where(t['technical'], p['technical'], 0)
+        pro += numpy.where((end != 0) & (end > p['recent_date']),
+                           (end - p['recent_date']) * p['recent_date_weight'],
+                           0)
+        pro += numpy.where(frequency > p['high_frequency'],
+                           p['high_frequency_weight'] * frequency, 0)
+        pro += numpy.where(size >= p['large_size'], log_size, 0)
+
+        anti = numpy.zeros(len(end))
+        anti += numpy.where((delta_score < 0) & (frequency < 1),
+                            numpy.abs(delta_score) * p['decrease_weight'], 0)
+        floor = p['low_frequency_floor']
+        anti += numpy.where(
+            frequency < floor, p['low_frequency'] / floor,
+            numpy.where(frequency < p['low_frequency'],
+                        p['low_frequency'] / numpy.maximum(frequency, floor),
+                        0))
+        anti += numpy.where((end != 0) & (end < p['early_date']),
+                            (p['early_date'] - end) * p['early_date_weight'],
+                            0)
+        anti += numpy.where((size < 1) & (size > 0), numpy.abs(log_size), 0)
+        for label in ('full', 'queried', 'partial'):
+            anti += numpy.where(t['obs_label'] == label, p['obs_' + label], 0)
+
+        mask = (end >= range_start) & (end <= range_end)
+        return {'pro': pro, 'anti': anti, 'diff': pro - anti, 'mask': mask}
+
+    def write(self, filepath):
+        with open(filepath, 'w') as csvfile:
+            csvw = csv.writer(csvfile)
+            csvw.writerows(self.output)
+
+
+def _merge_parameters(overrides):
+    parameters = dict(CurrencyEvaluator.parameters)
+    for name, value in (overrides or {}).items():
+        if name.upper().startswith('LOGICAL_CURRENCY_'):
+            raise ValueError('%s is applied when source_raw.csv is built; '
+                             'rerun raw_currency_data to vary it' % name)
+        if name not in parameters:
+            raise ValueError('Unknown currency parameter: %s' % name)
+        parameters[name] = value
+    return parameters
+
+
+def _parse_row(d):
+    for j in ('start', 'end', 'quotations', 'weighted size',
+              '1800-49', '1850-99', '1900-49', '1950-99', '2000-',
+              'frequency change'):
+        d[j] = float(d[j])
+    d['ODO-linked'] = d['ODO-linked'].lower() == 'true'
+    # 'logically current' stays as it is: 'high', 'low', or empty
+    return d
+
+
+def _delta_score(delta_score, cap):
+    if delta_score < -cap:
+        delta_score = -cap - math.log(abs(delta_score))
+    if delta_score > cap:
+        delta_score = cap + math.log(abs(delta_score))
+    return delta_score
+
+
+def _obs_label(header):
+    if header == 'Obs.':
+        return 'full'
+    elif header == '? Obs.' or header == '?Obs.':
+        return 'queried'
+    elif ('nonce' in header.lower() or
+            'now rare' in header.lower() or
+            'Obs' in header):
+        return 'partial'
+    else:
+        return None
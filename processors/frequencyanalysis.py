@@ -5,12 +5,17 @@ FrequencyAnalysis
 import os
 import re
 from collections import defaultdict
+from array import array
 import csv
 from math import log
 
 import numpy
 
-from lex.oed.resources.frequencyiterator import FrequencyIterator
+from processors.frequencyreader import frequency_iterator
+from processors.profiling import profile_entries
+from processors.shards import map_reduce, resource
+from processors.sampling import sample_entries, estimate_totals,\
+    estimate_statistics
 from lex.frequencytable import band_limits, sum_frequency_tables
 from lex.oed.resources.vitalstatistics import VitalStatisticsCache
 
@@ -28,149 +33,67 @@ headers = {
 }
 headers['high_delta_up'] = headers['high_frequency']
 headers['high_delta_down'] = headers['high_frequency']
+SUMMARY_PERIODS = headers['high_frequency'][1:]
+# Relative difference within which a value computed by numpy may differ
+#  from the value computed one entry at a time by the iterative mode (e.g.
+#  numpy.log vs math.log); see MatrixAccumulator.finalize()
+TOLERANCE = 1e-12
 
 
 class FrequencyAnalysis(object):
 
-    def __init__(self, **kwargs):
-        self.in_dir = kwargs.get('in_dir')
-        self.out_dir = kwargs.get('out_dir')
-
-    def analyse(self):
-        vs = VitalStatisticsCache()
-        self.track = {
-            'band_distribution': defaultdict(lambda: 0),
-            'total_frequency': defaultdict(lambda: 0),
-            'high_frequency': [],
-            'high_delta_up': [],
-            'high_delta_down': [],
-            'delta_dist': defaultdict(lambda: 0),
-            'plural_to_singular': [],
-            'high_frequency_rare': [],
-            'frequency_to_size_high': [],
-            'frequency_to_size_low': [],
-        }
+    """
+    Analyses the frequency data, producing a .csv file for each series
+    in self.track.
 
-        iterator = FrequencyIterator(in_dir=self.in_dir,
-                                     letters=None,
-                                     message='Analysing frequency data')
-        for e in iterator.iterate():
-            if not e.has_frequency_table():
-                self.track['band_distribution'][16] += 1
+    In 'iterative' mode, each entry is evaluated in turn. In 'matrix'
+    mode, entries are first loaded into a FrequencyMatrix, and each series
+    is then computed across all entries at once; the output is the same.
 
-            if e.has_frequency_table():
-                ft = e.frequency_table()
-                self.track['band_distribution'][ft.band(period='modern')] += 1
-
-                if ft.band(period='modern') <= 5:
-                    self.track['high_frequency'].append({
-                        'label': e.label,
-                        'id': e.id,
-                        'ftable': ft
-                    })
+    If a sample_rate is given, only that fraction of entries is analysed
+    (see processors.sampling), and whole-dictionary estimates of the band
+    distribution and period totals are written alongside the usual
+    output. Sampling always uses the matrix mode.
 
-                if ft.frequency(period='modern') > 0.5 and e.start < 1750:
-                    delta = ft.delta('1800-49', 'modern')
-                    if delta is not None:
-                        self.log_delta(delta, reciprocal=True)
-                        if delta > 2:
-                            self.track['high_delta_up'].append({
-                                'label': e.label,
-                                'id': e.id,
-                                'ftable': ft
-                            })
-
-                if (ft.frequency(period='1800-49') > 0.5 and
-                        not e.is_obsolete()):
-                    delta = ft.delta('1800-49', 'modern')
-                    if delta is not None and delta < 0.5:
-                        self.track['high_delta_down'].append({
-                            'label': e.label,
-                            'id': e.id,
-                            'ftable': ft
-                        })
-                        self.log_delta(delta)
-
-                if not ' ' in e.lemma and not '-' in e.lemma:
-                    for p in e.frequency_table().data.keys():
-                        self.track['total_frequency'][p] +=\
-                            ft.frequency(period=p)
-
-                if (ft.frequency() > 0.01 and
-                        self.is_marked_rare(vs.find(e.id, 'header'))):
-                    self.track['high_frequency_rare'].append({
-                        'label': e.label,
-                        'id': e.id,
-                        'header': vs.find(e.id, 'header'),
-                        'fpm': ft.frequency()
-                    })
-
-                if ft.frequency() > 1:
-                    self.compare_singular_to_plural(e)
-
-                if ft.frequency() >= 0.0001 and vs.find(e.id, 'quotations') > 0:
-                    ratio = log(ft.frequency()) / vs.find(e.id, 'quotations')
-                    if ratio > 0.2:
-                        self.track['frequency_to_size_high'].append({
-                            'label': e.label,
-                            'id': e.id,
-                            'quotations': vs.find(e.id, 'quotations'),
-                            'fpm': ft.frequency(),
-                            'ratio': ratio,
-                        })
-                    if vs.find(e.id, 'quotations') >= 20:
-                        self.track['frequency_to_size_low'].append({
-                            'label': e.label,
-                            'id': e.id,
-                            'quotations': vs.find(e.id, 'quotations'),
-                            'fpm': ft.frequency(),
-                            'ratio': ratio,
-                        })
-
-    def compare_singular_to_plural(self, e):
-        for wcs in e.wordclass_sets():
-            if (wcs.wordclass == 'NN' and
-                    wcs.frequency_table().frequency() > 1):
-                groups = defaultdict(list)
-                for type in wcs.types():
-                    groups[type.wordclass].append(type)
-                if 'NN' in groups and 'NNS' in groups:
-                    summed_nn = sum_frequency_tables([t.frequency_table()
-                        for t in groups['NN']
-                        if t.frequency_table() is not None])
-                    summed_nns = sum_frequency_tables([t.frequency_table()
-                        for t in groups['NNS']
-                        if t.frequency_table() is not None])
-                    f_nn = summed_nn.frequency()
-                    f_nns = summed_nns.frequency()
-                    if f_nn and f_nns / f_nn > 1:
-                        self.track['plural_to_singular'].append({
-                            'label': e.label,
-                            'id': e.id,
-                            'fpm': wcs.frequency_table().frequency(),
-                            'ratio': f_nns / f_nn
-                        })
+    The work is done by an accumulator (AnalysisAccumulator or
+    MatrixAccumulator). If processes is more than 1, letters are
+    accumulated in parallel and then merged (see processors.shards); the
+    output is the same.
+    """
 
-    def is_marked_rare(self, header):
-        if (header is not None and
-                len(header) < 100 and
-                'rare' in header and
-                not 'rarely' in header and
-                not 'rare before' in header):
-            return True
+    def __init__(self, **kwargs):
+        self.in_dir = kwargs.get('in_dir')
+        self.out_dir = kwargs.get('out_dir')
+        self.letters = kwargs.get('letters')
+        self.mode = kwargs.get('mode', 'iterative')
+        self.sample_rate = kwargs.get('sample_rate')
+        self.processes = kwargs.get('processes', 0)
+        self.matrix = None
+
+    def analyse(self, accumulator=None):
+        """
+        If an accumulator is given (e.g. one built letter by letter by a
+        processors.shards.LetterStream), the entries aren't read again.
+        """
+        if accumulator is None:
+            accumulator = map_reduce(self.accumulate, self.letters,
+                                     self.processes)
+        self.track = accumulator.finalize()
+        self.matrix = accumulator.matrix
+
+    def accumulate(self, letters):
+        if self.mode == 'matrix' or self.sample_rate is not None:
+            accumulator = MatrixAccumulator()
         else:
-            return False
-
-    def log_delta(self, delta, reciprocal=False):
-        if delta is not None:
-            if reciprocal and delta != 0:
-                delta = 1 / delta
-            delta = round(delta, 1)
-            if delta > 2:
-                delta = float(int(delta))
-            if delta > 10:
-                delta = float(10)
-            self.track['delta_dist'][delta] += 1
+            accumulator = AnalysisAccumulator()
+        vs = resource(VitalStatisticsCache)
+        iterator = frequency_iterator(in_dir=self.in_dir,
+                                      letters=letters,
+                                      message='Analysing frequency data')
+        for e in sample_entries(profile_entries(iterator.iterate()),
+                                self.sample_rate):
+            accumulator.update(e, vs)
+        return accumulator
 
     def write(self):
         for series in self.track.keys():
@@ -201,23 +124,22 @@ class FrequencyAnalysis(object):
                     series == 'high_delta_down'):
                 if series == 'high_frequency':
                     hf = sorted(self.track[series],
-                                key=lambda e: e['ftable'].frequency(),
+                                key=lambda e: e['fpm'],
                                 reverse=True)
                 elif series == 'high_delta_up':
                     hf = sorted(self.track[series],
-                                key=lambda e: e['ftable'].delta('1800-49', 'modern'),
+                                key=lambda e: e['delta'],
                                 reverse=True)
                 elif series == 'high_delta_down':
                     hf = sorted(self.track[series],
-                                key=lambda e: e['ftable'].delta('1800-49', 'modern'))
+                                key=lambda e: e['delta'])
                 if series == 'high_frequency':
                     hf = hf[:4999]
                 else:
                     hf = hf[:999]
                 for e in hf:
                     r = [e['label'],]
-                    for p in ('1750-99', '1800-49', '1900-19', '1950-59', 'modern'):
-                        r.append(e['ftable'].frequency(period=p))
+                    r.extend(e['frequencies'])
                     rows.append(r)
 
             elif (series == 'frequency_to_size_high' or
@@ -248,10 +170,505 @@ class FrequencyAnalysis(object):
                     r = (e['label'], e['fpm'], e['header'])
                     rows.append(r)
 
-            filename = os.path.join(self.out_dir, '%s.csv' % series)
-            with open(filename, 'w') as csvfile:
-                csvw = csv.writer(csvfile)
-                csvw.writerows(rows)
+            self.write_rows(series, rows)
+
+        if self.sample_rate is not None:
+            self.write_estimates()
+
+    def write_estimates(self):
+        m = self.matrix
+        # Entries without a frequency table are part of the sample too,
+        #  so they're included as rows (in band 16, with no frequency)
+        bands = numpy.concatenate((m.band,
+                                   numpy.full(m.missing, 16, dtype=int)))
+        band_values = numpy.unique(bands)
+        contributions = bands[:, None] == band_values[None, :]
+        rows = [('band', 'range', 'est. num. entries', 'low', 'high')]
+        for b, estimate, low, high in zip(band_values.tolist(),
+                *estimate_totals(contributions, self.sample_rate)):
+            if not b in band_ranges:
+                label = 'n/a'
+            else:
+                label = band_ranges[b][2]
+            rows.append((b, label, int(round(estimate)), int(round(low)),
+                         int(round(high))))
+        self.write_rows('band_distribution_estimate', rows)
+
+        single_words = m.present & ~m.multiword[:, None]
+        contributions = numpy.vstack((
+            numpy.where(single_words, m.values, 0),
+            numpy.zeros((m.missing, len(m.periods)))))
+        rows = [('period', 'est. % of corpus', 'low', 'high')]
+        for p, estimate, low, high in sorted(zip(m.periods,
+                *estimate_totals(contributions, self.sample_rate))):
+            rows.append((p, '%0.4g' % (estimate / 10000),
+                         '%0.4g' % (low / 10000), '%0.4g' % (high / 10000)))
+        self.write_rows('total_frequency_estimate', rows)
+
+    def write_rows(self, series, rows):
+        filename = os.path.join(self.out_dir, '%s.csv' % series)
+        with open(filename, 'w') as csvfile:
+            csvw = csv.writer(csvfile)
+            csvw.writerows(rows)
+
+
+class AnalysisAccumulator(object):
+
+    """
+    Partial FrequencyAnalysis results for a shard of entries, evaluating
+    each entry in turn ('iterative' mode). update() adds an entry, merge()
+    appends the results for the shard that follows, and finalize()
+    returns the tracked series.
+
+    Period totals are only added up in finalize(), so that totals merged
+    from several shards are summed in the same sequence as in a single
+    pass (and so are identical).
+    """
+
+    def __init__(self):
+        self.track = {
+            'band_distribution': defaultdict(int),
+            'total_frequency': defaultdict(int),
+            'high_frequency': [],
+            'high_delta_up': [],
+            'high_delta_down': [],
+            'delta_dist': defaultdict(int),
+            'plural_to_singular': [],
+            'high_frequency_rare': [],
+            'frequency_to_size_high': [],
+            'frequency_to_size_low': [],
+        }
+        self.totals = {}
+        self.matrix = None
+
+    def update(self, e, vs):
+        if not e.has_frequency_table():
+            self.track['band_distribution'][16] += 1
+
+        if e.has_frequency_table():
+            ft = e.frequency_table()
+            self.track['band_distribution'][ft.band(period='modern')] += 1
+
+            if ft.band(period='modern') <= 5:
+                self.track['high_frequency'].append(_summary(e, ft))
+
+            if ft.frequency(period='modern') > 0.5 and e.start < 1750:
+                delta = ft.delta('1800-49', 'modern')
+                if delta is not None:
+                    self.log_delta(delta, reciprocal=True)
+                    if delta > 2:
+                        self.track['high_delta_up'].append(
+                            _summary(e, ft, delta))
+
+            if (ft.frequency(period='1800-49') > 0.5 and
+                    not e.is_obsolete()):
+                delta = ft.delta('1800-49', 'modern')
+                if delta is not None and delta < 0.5:
+                    self.track['high_delta_down'].append(
+                        _summary(e, ft, delta))
+                    self.log_delta(delta)
+
+            if not ' ' in e.lemma and not '-' in e.lemma:
+                for p in e.frequency_table().data.keys():
+                    self.totals.setdefault(p, array('d')).append(
+                        ft.frequency(period=p))
+
+            if ft.frequency() > 0.01:
+                self.check_rare(e, ft, vs.find(e.id, 'header'))
+
+            if ft.frequency() > 1:
+                self.compare_singular_to_plural(e)
+
+            if ft.frequency() >= 0.0001 and vs.find(e.id, 'quotations') > 0:
+                ratio = log(ft.frequency()) / vs.find(e.id, 'quotations')
+                if ratio > 0.2:
+                    self.track['frequency_to_size_high'].append({
+                        'label': e.label,
+                        'id': e.id,
+                        'quotations': vs.find(e.id, 'quotations'),
+                        'fpm': ft.frequency(),
+                        'ratio': ratio,
+                    })
+                if vs.find(e.id, 'quotations') >= 20:
+                    self.track['frequency_to_size_low'].append({
+                        'label': e.label,
+                        'id': e.id,
+                        'quotations': vs.find(e.id, 'quotations'),
+                        'fpm': ft.frequency(),
+                        'ratio': ratio,
+                    })
+
+    def merge(self, other):
+        for series, values in other.track.items():
+            if isinstance(values, list):
+                self.track[series].extend(values)
+            else:
+                for key, value in values.items():
+                    self.track[series][key] += value
+        for period, values in other.totals.items():
+            self.totals.setdefault(period, array('d')).extend(values)
+        return self
+
+    def finalize(self):
+        for period, values in self.totals.items():
+            # cumsum adds in sequence, as a single pass would
+            self.track['total_frequency'][period] +=\
+                numpy.cumsum(values)[-1].item()
+        self.totals = {}
+        return self.track
+
+    def check_rare(self, e, ft, header):
+        if self.is_marked_rare(header):
+            self.track['high_frequency_rare'].append({
+                'label': e.label,
+                'id': e.id,
+                'header': header,
+                'fpm': ft.frequency()
+            })
+
+    def compare_singular_to_plural(self, e):
+        for wcs in e.wordclass_sets():
+            if (wcs.wordclass == 'NN' and
+                    wcs.frequency_table().frequency() > 1):
+                groups = defaultdict(list)
+                for type in wcs.types():
+                    groups[type.wordclass].append(type)
+                if 'NN' in groups and 'NNS' in groups:
+                    summed_nn = sum_frequency_tables([t.frequency_table()
+                        for t in groups['NN']
+                        if t.frequency_table() is not None])
+                    summed_nns = sum_frequency_tables([t.frequency_table()
+                        for t in groups['NNS']
+                        if t.frequency_table() is not None])
+                    f_nn = summed_nn.frequency()
+                    f_nns = summed_nns.frequency()
+                    if f_nn and f_nns / f_nn > 1:
+                        self.track['plural_to_singular'].append({
+                            'label': e.label,
+                            'id': e.id,
+                            'fpm': wcs.frequency_table().frequency(),
+                            'ratio': f_nns / f_nn
+                        })
+
+    def is_marked_rare(self, header):
+        if (header is not None and
+                len(header) < 100 and
+                'rare' in header and
+                not 'rarely' in header and
+                not 'rare before' in header):
+            return True
+        else:
+            return False
+
+    def log_delta(self, delta, reciprocal=False):
+        if delta is not None:
+            if reciprocal and delta != 0:
+                delta = 1 / delta
+            delta = round(delta, 1)
+            if delta > 2:
+                delta = float(int(delta))
+            if delta > 10:
+                delta = float(10)
+            self.track['delta_dist'][delta] += 1
+
+    def log_deltas(self, deltas, reciprocal=False):
+        """
+        log_delta() for an array of deltas.
+        """
+        if reciprocal:
+            with numpy.errstate(divide='ignore'):
+                deltas = numpy.where(deltas != 0, 1 / deltas, deltas)
+        rounded = numpy.round(deltas, 1)
+        # numpy.round() multiplies by 10 and rounds half to even, which
+        #  can disagree with round() for values close to a half; those are
+        #  rounded one at a time
+        scaled = deltas * 10
+        halves = numpy.flatnonzero(
+            numpy.abs(scaled - numpy.floor(scaled) - 0.5) < 1e-6)
+        for i in halves.tolist():
+            rounded[i] = round(deltas[i].item(), 1)
+        rounded = numpy.where(rounded > 2, numpy.trunc(rounded), rounded)
+        rounded = numpy.where(rounded > 10, 10.0, rounded)
+        values, counts = numpy.unique(rounded, return_counts=True)
+        for delta, count in zip(values.tolist(), counts.tolist()):
+            self.track['delta_dist'][delta] += count
+
+
+class MatrixAccumulator(AnalysisAccumulator):
+
+    """
+    Partial FrequencyAnalysis results in 'matrix' mode: entries are
+    loaded into a FrequencyMatrix (shards are merged by appending their
+    matrices), and finalize() computes each series across all entries at
+    once.
+    """
+
+    def __init__(self):
+        AnalysisAccumulator.__init__(self)
+        self.matrix = FrequencyMatrix()
+
+    def update(self, e, vs):
+        ft = self.matrix.add(e, vs)
+        if ft is not None:
+            # These depend on per-entry data that doesn't fit in the
+            #  matrix, but only apply to a small minority of entries
+            if ft.frequency() > 0.01:
+                self.check_rare(e, ft, vs.find(e.id, 'header'))
+            if ft.frequency() > 1:
+                self.compare_singular_to_plural(e)
+
+    def merge(self, other):
+        AnalysisAccumulator.merge(self, other)
+        self.matrix.merge(other.matrix)
+        return self
+
+    def finalize(self):
+        self.matrix.finalize()
+        m = self.matrix
+
+        bands, counts = numpy.unique(m.band, return_counts=True)
+        for band, count in zip(bands.tolist(), counts.tolist()):
+            self.track['band_distribution'][band] += count
+        if m.missing:
+            self.track['band_distribution'][16] += m.missing
+
+        high_frequency = numpy.flatnonzero(m.band <= 5)
+        self.add_summaries('high_frequency', m, high_frequency,
+                           _top(m.fpm[high_frequency], 4999, reverse=True))
+
+        modern = m.column('modern')
+        early = m.column('1800-49')
+        has_delta = ~numpy.isnan(m.delta)
+        up = numpy.flatnonzero((modern > 0.5) & (m.start < 1750) & has_delta)
+        self.log_deltas(m.delta[up], reciprocal=True)
+        up = up[m.delta[up] > 2]
+        self.add_summaries('high_delta_up', m, up,
+                           _top(m.delta[up], 999, reverse=True))
+
+        down = numpy.flatnonzero((early > 0.5) & ~m.obsolete & has_delta &
+                                 (m.delta < 0.5))
+        self.log_deltas(m.delta[down])
+        self.add_summaries('high_delta_down', m, down,
+                           _top(m.delta[down], 999))
+
+        single_words = ~m.multiword
+        for j, period in enumerate(m.periods):
+            values = m.values[single_words & m.present[:, j], j]
+            if len(values):
+                # cumsum adds in sequence, as the iterative mode does, so
+                #  the totals are identical
+                self.track['total_frequency'][period] +=\
+                    numpy.cumsum(values)[-1].item()
+
+        sized = numpy.flatnonzero((m.fpm >= 0.0001) & (m.quotations > 0))
+        ratios = numpy.log(m.fpm[sized]) / m.quotations[sized]
+
+        # numpy.log can differ from math.log in the last place, so ratios
+        #  close enough to the threshold or to the cut-off of a series for
+        #  that to matter (and so all those reported) are recomputed as
+        #  the iterative mode computes them
+        def recompute(positions):
+            for k in positions.tolist():
+                i = sized[k]
+                ratios[k] = log(m.fpms[i]) / m.sizes[i]
+
+        recompute(numpy.flatnonzero(numpy.abs(ratios - 0.2) <=
+                                    0.2 * TOLERANCE))
+        high = numpy.flatnonzero(ratios > 0.2)
+        low = numpy.flatnonzero(m.quotations[sized] >= 20)
+        recompute(high[_near_top(ratios[high], 999, reverse=True)])
+        recompute(low[_near_top(ratios[low], 999)])
+        for series, selection, top in (
+                ('frequency_to_size_high', high,
+                 _top(ratios[high], 999, reverse=True, later_first=True)),
+                ('frequency_to_size_low', low, _top(ratios[low], 999))):
+            for k in selection[top].tolist():
+                i = sized[k]
+                self.track[series].append({
+                    'label': m.labels[i],
+                    'id': m.ids[i],
+                    'quotations': m.sizes[i],
+                    'fpm': m.fpms[i],
+                    'ratio': ratios[k].item(),
+                })
+        return self.track
+
+    def add_summaries(self, series, matrix, selection, top):
+        for i in selection[top].tolist():
+            self.track[series].append({
+                'label': matrix.labels[i],
+                'id': matrix.ids[i],
+                'fpm': matrix.fpms[i],
+                'delta': matrix.deltas[i],
+                'frequencies': matrix.summaries[i],
+            })
+
+
+class FrequencyMatrix(object):
+
+    """
+    Entries x periods matrix of frequencies for all entries that have a
+    frequency table, with aligned metadata columns.
+
+    Numeric columns are numpy arrays (available after finalize()) used
+    for selection and sorting; the original values reported in the
+    output are kept alongside in plain lists (fpms, deltas, sizes,
+    summaries), so that output is identical to the iterative analysis.
+    """
+
+    def __init__(self):
+        self.labels = []
+        self.ids = []
+        self.fpms = []
+        self.deltas = []
+        self.sizes = []
+        self.summaries = []
+        self.columns = defaultdict(list)
+        # (row, column, value) of each frequency, as parallel arrays
+        self.cell_rows = array('i')
+        self.cell_cols = array('i')
+        self.cell_values = array('d')
+        self.periods = []
+        self.period_index = {}
+        self.missing = 0
+
+    def add(self, e, vs):
+        """
+        Add an entry; returns its frequency table (or None if it doesn't
+        have one, in which case it's only counted).
+        """
+        if not e.has_frequency_table():
+            self.missing += 1
+            return None
+        ft = e.frequency_table()
+        row = len(self.labels)
+        delta = ft.delta('1800-49', 'modern')
+        fpm = ft.frequency()
+        if fpm >= 0.0001:
+            size = vs.find(e.id, 'quotations')
+        else:
+            size = 0
+
+        self.labels.append(e.label)
+        self.ids.append(e.id)
+        self.fpms.append(fpm)
+        self.deltas.append(delta)
+        self.sizes.append(size)
+        self.summaries.append(tuple([ft.frequency(period=p)
+                                     for p in SUMMARY_PERIODS]))
+        self.columns['band'].append(ft.band(period='modern'))
+        self.columns['start'].append(e.start)
+        self.columns['obsolete'].append(e.is_obsolete())
+        self.columns['multiword'].append(' ' in e.lemma or '-' in e.lemma)
+        for p in ft.data.keys():
+            if p not in self.period_index:
+                self.period_index[p] = len(self.periods)
+                self.periods.append(p)
+            self.cell_rows.append(row)
+            self.cell_cols.append(self.period_index[p])
+            self.cell_values.append(ft.frequency(period=p))
+        return ft
+
+    def merge(self, other):
+        """
+        Append the entries of another (unfinalized) matrix, as if they
+        had been added after this matrix's entries.
+        """
+        offset = len(self.labels)
+        for name in ('labels', 'ids', 'fpms', 'deltas', 'sizes',
+                     'summaries'):
+            getattr(self, name).extend(getattr(other, name))
+        for name, values in other.columns.items():
+            self.columns[name].extend(values)
+        for p in other.periods:
+            if p not in self.period_index:
+                self.period_index[p] = len(self.periods)
+                self.periods.append(p)
+        # other's column -> this matrix's column
+        remap = numpy.array([self.period_index[p] for p in other.periods],
+                            dtype=numpy.intc)
+        rows = numpy.frombuffer(other.cell_rows, dtype=numpy.intc)
+        cols = numpy.frombuffer(other.cell_cols, dtype=numpy.intc)
+        self.cell_rows.frombytes((rows + offset).astype(numpy.intc)
+                                 .tobytes())
+        self.cell_cols.frombytes(remap[cols].tobytes())
+        self.cell_values.extend(other.cell_values)
+        self.missing += other.missing
+        return self
+
+    def finalize(self):
+        size = len(self.labels)
+        self.band = numpy.array(self.columns['band'], dtype=int)
+        self.start = numpy.array(self.columns['start'], dtype=float)
+        self.obsolete = numpy.array(self.columns['obsolete'], dtype=bool)
+        self.multiword = numpy.array(self.columns['multiword'], dtype=bool)
+        self.fpm = numpy.array(self.fpms, dtype=float)
+        self.delta = numpy.array([numpy.nan if d is None else d
+                                  for d in self.deltas], dtype=float)
+        self.quotations = numpy.array(self.sizes, dtype=float)
+        self.summary = numpy.array(self.summaries,
+                                   dtype=float).reshape(size,
+                                                        len(SUMMARY_PERIODS))
+
+        self.values = numpy.zeros((size, len(self.periods)))
+        self.present = numpy.zeros((size, len(self.periods)), dtype=bool)
+        rows = numpy.frombuffer(self.cell_rows, dtype=numpy.intc)
+        cols = numpy.frombuffer(self.cell_cols, dtype=numpy.intc)
+        self.values[rows, cols] = numpy.frombuffer(self.cell_values)
+        self.present[rows, cols] = True
+        self.columns = None
+        self.cell_rows = self.cell_cols = self.cell_values = None
+
+    def column(self, period):
+        return self.summary[:, SUMMARY_PERIODS.index(period)]
+
+
+def _summary(e, ft, delta=None):
+    return {
+        'label': e.label,
+        'id': e.id,
+        'fpm': ft.frequency(),
+        'delta': delta,
+        'frequencies': tuple([ft.frequency(period=p)
+                              for p in SUMMARY_PERIODS]),
+    }
+
+
+def _near_top(values, k, reverse=False):
+    """
+    Returns the positions of every value that could be among the first k
+    (see _top()) if the values were out by up to TOLERANCE.
+    """
+    if len(values) <= k:
+        return numpy.arange(len(values))
+    if reverse:
+        keys = -values
+    else:
+        keys = values
+    kth = keys[numpy.argpartition(keys, k - 1)[k - 1]]
+    return numpy.flatnonzero(keys <= kth + abs(kth) * TOLERANCE)
+
+
+def _top(values, k, reverse=False, later_first=False):
+    """
+    Returns the positions of the first k values, as they would be ordered
+    by a stable sort (descending if reverse is True), with ties broken by
+    position (later positions first if later_first is True). Positions are
+    returned in their original order.
+    """
+    if len(values) <= k:
+        return numpy.arange(len(values))
+    if reverse:
+        keys = -values
+    else:
+        keys = values
+    positions = numpy.arange(len(values))
+    if later_first:
+        positions = -positions
+    kth = keys[numpy.argpartition(keys, k - 1)[k - 1]]
+    candidates = numpy.flatnonzero(keys <= kth)
+    order = numpy.lexsort((positions[candidates], keys[candidates]))
+    return numpy.sort(candidates[order[:k]])
 
 
 class OecComparison(object):
@@ -334,25 +751,64 @@ class OecComparison(object):
 class PosRatios(object):
 
     def __init__(self, **kwargs):
-        self.in_dir = kwargs.get('inDir')
-        self.out_dir = kwargs.get('outDir')
-
-    def measure_ratios(self):
-        ratios = defaultdict(list)
-        iterator = FrequencyIterator(in_dir=self.in_dir,
-                                     letters=None,
-                                     message='Analysing p.o.s. ratios')
-        for e in iterator.iterate():
-            for wcs in e.wordclass_sets():
-                if ((wcs.wordclass == 'NN' or wcs.wordclass == 'VB') and
-                    wcs.has_frequency_table()):
-                    total = wcs.frequency_table().frequency()
-                    local = defaultdict(lambda: 0)
-                    for type in wcs.types():
-                        if type.frequency_table().frequency() > 0:
-                            local[type.wordclass] += type.frequency_table().frequency()
-                    for wordclass, fpm in local.items():
-                        ratios[wordclass].append(total / fpm)
-
+        self.in_dir = kwargs.get('in_dir')
+        self.out_dir = kwargs.get('out_dir')
+        self.letters = kwargs.get('letters')
+        self.sample_rate = kwargs.get('sample_rate')
+        self.processes = kwargs.get('processes', 0)
+
+    def measure_ratios(self, accumulator=None):
+        if accumulator is None:
+            accumulator = map_reduce(self.accumulate, self.letters,
+                                     self.processes)
+        ratios = accumulator.finalize()
         for wordclass in ratios:
-            print('%s\t%0.4g' % (wordclass, numpy.median(ratios[wordclass])))
+            if self.sample_rate is None:
+                print('%s\t%0.4g' % (wordclass,
+                                     numpy.median(ratios[wordclass])))
+            else:
+                _, median, low, high = estimate_statistics(
+                    ratios[wordclass], {'median': numpy.median})[0]
+                print('%s\t%0.4g\t(%0.4g-%0.4g)' % (wordclass, median,
+                                                    low, high))
+
+    def accumulate(self, letters):
+        accumulator = RatioAccumulator()
+        iterator = frequency_iterator(in_dir=self.in_dir,
+                                      letters=letters,
+                                      message='Analysing p.o.s. ratios')
+        for e in sample_entries(profile_entries(iterator.iterate()),
+                                self.sample_rate):
+            accumulator.update(e)
+        return accumulator
+
+
+class RatioAccumulator(object):
+
+    """
+    Partial PosRatios results for a shard of entries: lists of ratios
+    for each wordclass, in entry order.
+    """
+
+    def __init__(self):
+        self.ratios = defaultdict(list)
+
+    def update(self, e):
+        for wcs in e.wordclass_sets():
+            if ((wcs.wordclass == 'NN' or wcs.wordclass == 'VB') and
+                wcs.has_frequency_table()):
+                total = wcs.frequency_table().frequency()
+                local = defaultdict(lambda: 0)
+                for type in wcs.types():
+                    if type.frequency_table().frequency() > 0:
+                        local[type.wordclass] += type.frequency_table().frequency()
+                for wordclass, fpm in local.items():
+                    self.ratios[wordclass].append(total / fpm)
+
+    def merge(self, other):
+        for wordclass, ratios in other.ratios.items():
+            self.ratios[wordclass].extend(ratios)
+        return self
+
+    def finalize(self):
+        return self.ratios
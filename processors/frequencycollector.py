@@ -3,7 +3,10 @@ FrequencyCollector - Collects frequency data for OED entries from GEL
 """
 
 import os
+import copy
+import queue
 import string
+import threading
 from collections import defaultdict, namedtuple
 
 from lxml import etree
@@ -11,11 +14,13 @@ from lxml import etree
 from lex.gel.dataiterator import OedContentIterator
 from lex.entryiterator import EntryIterator
 from lex.frequencytable import sum_frequency_tables
+from processors.profiling import profile_letter, profile_thread
 
 XSLPI = etree.PI('xml-stylesheet',
                  'type="text/xsl" href="../chrome/xsl/base.xsl"')
 MAX_BUFFER = 2000  # entries per file
 DEF_LENGTH = 50  # number of characters in definition
+WRITE_QUEUE = 4  # completed buffers waiting to be written
 
 WordclassData = namedtuple('WordclassData', ['wordclass', 'frequency_table',
                                              'types'])
@@ -24,65 +29,147 @@ TypeData = namedtuple('TypeData', ['form', 'wordclass', 'frequency_table'])
 
 class FrequencyCollector(object):
 
+    """
+    Collects frequency data for each entry, writing it to out_dir (with
+    subentries too if include_subentries is True).
+
+    If full_out_dir is also given, a second set of files including
+    subentries is written there in the same pass, so that the entry-only
+    and full frequency sets can be built from a single walk through the
+    OED.
+
+    If an on_letter callback is given, it's called with each letter once
+    all of the letter's files have been written, so that downstream
+    stages can start on the letter while later letters are collected.
+    """
+
     def __init__(self, **kwargs):
         self.out_dir = kwargs.get('out_dir')
         self.terse = kwargs.get('terse', True)
-        self.include_subentries = kwargs.get('include_subentries', False)
-        self.frequencies = None
-        self.filecount = None
+        self.letters = kwargs.get('letters') or string.ascii_lowercase
+        self.on_letter = kwargs.get('on_letter')
+        self.outputs = [OutputBuffer(self.out_dir,
+                                     kwargs.get('include_subentries', False))]
+        if kwargs.get('full_out_dir'):
+            self.outputs.append(OutputBuffer(kwargs.get('full_out_dir'), True))
+        self.include_subentries = any([output.include_subentries
+                                       for output in self.outputs])
 
     def process(self):
-        for letter in string.ascii_lowercase:
-            _clear_dir(self.out_dir, letter)
-            frequencies, subfrequencies = _load_frequency_data(letter, self.include_subentries)
-
-            print('Listing frequencies for entries in %s...' % letter)
-            file_filter = 'oed_%s.xml' % letter.upper()
-            iterator = EntryIterator(dictType='oed',
-                                     fixLigatures=True,
-                                     fileFilter=file_filter,
-                                     verbosity=None)
-
-            self.filecount = 0
-            previous = None
+        self.writer = BufferWriter()
+        try:
+            for letter in self.letters:
+                with profile_letter(letter):
+                    self.process_letter(letter)
+                if self.on_letter is not None:
+                    self.writer.flush()
+                    self.on_letter(letter)
+        except BaseException:
+            # Closing the writer re-raises any error from writing; don't
+            #  let that hide the error that's already being raised.
+            try:
+                self.writer.close()
+            except Exception as error:
+                print('Error writing frequency files: %s' % error)
+            raise
+        else:
+            self.writer.close()
+
+    def process_letter(self, letter):
+        for output in self.outputs:
+            output.start(letter, self.writer)
+        frequencies, subfrequencies, subentry_index =\
+            _load_frequency_data(letter, self.include_subentries)
+
+        print('Listing frequencies for entries in %s...' % letter)
+        file_filter = 'oed_%s.xml' % letter.upper()
+        iterator = EntryIterator(dictType='oed',
+                                 fixLigatures=True,
+                                 fileFilter=file_filter,
+                                 verbosity=None)
+
+        previous = None
+        for e in iterator.iterate():
+            sortcode = e.lemma_manager().lexical_sort()
+
+            if e.id in frequencies:
+                frequency_blocks = frequencies[e.id]
+            else:
+                frequency_blocks = []
+            enode = _construct_node(e, 'entry', e.id, 0, e.label(),
+                                    e.label(), frequency_blocks, self.terse)
+
+            subnodes = []
+            if self.include_subentries and e.id in subentry_index:
+                for sense in _subentry_senses(e, subentry_index[e.id]):
+                    frequency_blocks = subfrequencies[(e.id, sense.node_id())]
+                    subnode = _construct_node(sense, 'subentry',
+                        e.id, sense.node_id(), sense.lemma, e.label(),
+                        frequency_blocks, self.terse)
+                    subnodes.append(subnode)
+
+            # A node can only belong to one doc, and a doc may be
+            #  serialised by the writer thread as soon as it's queued, so
+            #  every output but the last gets its own copies, made before
+            #  any of the nodes are added to a buffer.
+            last = len(self.outputs) - 1
+            for i, output in enumerate(self.outputs):
+                nodes = [enode]
+                if output.include_subentries:
+                    nodes.extend(subnodes)
+                if i < last:
+                    nodes = [copy.deepcopy(node) for node in nodes]
+                for node in nodes:
+                    output.append(node)
+                output.rotate(sortcode, previous)
+            previous = sortcode
+
+        for output in self.outputs:
+            output.write_buffer()
+
+
+class OutputBuffer(object):
+
+    """
+    Buffers nodes for one output directory, handing each completed
+    buffer to a BufferWriter as the next numbered file for the letter.
+    """
+
+    def __init__(self, out_dir, include_subentries):
+        self.out_dir = out_dir
+        self.include_subentries = include_subentries
+        self.letter = None
+        self.writer = None
+        self.filecount = None
+        self.doc = None
+
+    def start(self, letter, writer):
+        _clear_dir(self.out_dir, letter)
+        self.letter = letter
+        self.writer = writer
+        self.filecount = 0
+        self.initialize_doc()
+
+    def append(self, node):
+        self.doc.append(node)
+
+    def rotate(self, sortcode, previous):
+        if self.buffersize() >= MAX_BUFFER and sortcode != previous:
+            self.write_buffer()
             self.initialize_doc()
-            for e in iterator.iterate():
-                sortcode = e.lemma_manager().lexical_sort()
-
-                if e.id in frequencies:
-                    frequency_blocks = frequencies[e.id]
-                else:
-                    frequency_blocks = []
-                enode = _construct_node(e, 'entry', e.id, 0, e.label(),
-                                        e.label(), frequency_blocks, self.terse)
-                self.doc.append(enode)
-
-                if self.include_subentries:
-                    for sense in e.senses():
-                        sig = (e.id, sense.node_id())
-                        if sig in subfrequencies:
-                            frequency_blocks = subfrequencies[sig]
-                            subnode = _construct_node(sense, 'subentry',
-                                e.id, sense.node_id(), sense.lemma, e.label(),
-                                frequency_blocks, self.terse)
-                            self.doc.append(subnode)
-
-                if self.buffersize() >= MAX_BUFFER and sortcode != previous:
-                    self.write_buffer(letter)
-                    self.initialize_doc()
-                previous = sortcode
-            self.write_buffer(letter)
-
-    def write_buffer(self, letter):
-        filepath = os.path.join(self.out_dir, letter, self.next_filename())
-        with open(filepath, 'w') as filehandle:
-            filehandle.write('<?xml version="1.0" encoding="UTF-8"?>\n')
-            filehandle.write(etree.tounicode(self.doc.getroottree(),
-                                             pretty_print=True))
+
+    def write_buffer(self):
+        # The filename is fixed here, in order, before the buffer is
+        #  handed off; the doc is not touched again once queued.
+        filepath = os.path.join(self.out_dir, self.letter,
+                                self.next_filename())
+        self.writer.put(filepath, self.doc)
 
     def initialize_doc(self):
         self.doc = etree.Element('entries')
-        self.doc.addprevious(XSLPI)
+        # Each doc needs its own copy of the PI: adding the same node to
+        #  a new doc would move it out of one still waiting to be written.
+        self.doc.addprevious(copy.copy(XSLPI))
 
     def buffersize(self):
         return len(self.doc)
@@ -92,6 +179,64 @@ class FrequencyCollector(object):
         return '%04d.xml' % self.filecount
 
 
+class BufferWriter(object):
+
+    """
+    Serialises and writes completed buffers in a background thread, so
+    that the collector can carry on iterating entries in the meantime.
+
+    The queue is bounded: put() blocks once WRITE_QUEUE buffers are
+    waiting, so memory use stays bounded if writing falls behind. Any
+    error raised while writing is re-raised in the calling thread on
+    the next put(), flush() or close().
+    """
+
+    def __init__(self, maxsize=WRITE_QUEUE):
+        self.queue = queue.Queue(maxsize=maxsize)
+        self.error = None
+        self.thread = threading.Thread(target=self.run, name='BufferWriter',
+                                       daemon=True)
+        self.thread.start()
+
+    def put(self, filepath, doc):
+        self.check()
+        self.queue.put((filepath, doc))
+
+    def flush(self):
+        self.queue.join()
+        self.check()
+
+    def close(self):
+        self.queue.put(None)
+        self.thread.join()
+        self.check()
+
+    def check(self):
+        if self.error is not None:
+            raise self.error
+
+    def run(self):
+        while True:
+            item = self.queue.get()
+            try:
+                if item is None:
+                    return
+                if self.error is None:
+                    with profile_thread():
+                        _write_doc(*item)
+            except Exception as error:
+                self.error = error
+            finally:
+                self.queue.task_done()
+
+
+def _write_doc(filepath, doc):
+    with open(filepath, 'w') as filehandle:
+        filehandle.write('<?xml version="1.0" encoding="UTF-8"?>\n')
+        filehandle.write(etree.tounicode(doc.getroottree(),
+                                         pretty_print=True))
+
+
 def _clear_dir(directory, letter):
     sub_dir = os.path.join(directory, letter)
     if not os.path.isdir(sub_dir):
@@ -101,8 +246,15 @@ def _clear_dir(directory, letter):
 
 
 def _load_frequency_data(letter, include_subentries):
+    """
+    Returns frequency data for entries (keyed by entry ID) and for
+    subentries (keyed by (entry ID, node ID)), plus an index listing, for
+    each entry ID, the node IDs of the subentries that carry frequency
+    data.
+    """
     frequencies = defaultdict(list)
     subfrequencies = defaultdict(list)
+    subentry_index = defaultdict(list)
     iterator = OedContentIterator(letter=letter,
                                   include_entries=True,
                                   include_subentries=include_subentries)
@@ -122,9 +274,27 @@ def _load_frequency_data(letter, include_subentries):
             if wordclass_set.oed_entry_type() == 'entry':
                 frequencies[oed_id].append(wcdata)
             else:
+                if (oed_id, node_id) not in subfrequencies:
+                    subentry_index[oed_id].append(node_id)
                 subfrequencies[(oed_id, node_id)].append(wcdata)
 
-    return frequencies, subfrequencies
+    return frequencies, subfrequencies, subentry_index
+
+
+def _subentry_senses(entry, node_ids):
+    """
+    Yields the senses of the entry with the given node IDs, in document
+    order. Stops walking the entry's senses as soon as all have been
+    found.
+    """
+    remaining = set(node_ids)
+    for sense in entry.senses():
+        node_id = sense.node_id()
+        if node_id in remaining:
+            yield sense
+            remaining.discard(node_id)
+            if not remaining:
+                break
 
 
 def _construct_node(block, block_type, entry_id, node_id, label, parent_label,
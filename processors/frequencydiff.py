@@ -0,0 +1,218 @@
+"""
+FrequencyDiff - Compares two builds of the frequency data
+
+Either build can be a frequency directory (FREQUENCY_DIR or
+FULL_FREQUENCY_DIR) or a .csv file produced by xml_to_csv. As in the .csv
+file, only entries with a frequency table are compared, and modern
+frequency/band are used. Records from either kind of build carry a
+digest of the same normalised fields (label, modern frequency and band),
+so that identical records can be skipped without comparing fields.
+
+The .csv file doesn't record which letter's file each entry came from,
+so when only some letters are compared, .csv rows are filtered on the
+initial of the label (see _initial()); entries filed under a different
+letter from their label's initial may show up as added or removed.
+
+Each build is streamed into sorted runs on disk, then merged in
+(xrid, xrnode) order, so memory use is bounded by RUN_SIZE regardless of
+the size of the builds.
+"""
+
+import os
+import csv
+import string
+import unicodedata
+import heapq
+import hashlib
+import tempfile
+from collections import namedtuple
+
+from processors.frequencyreader import frequency_iterator
+from processors.profiling import profile_entries
+
+RUN_SIZE = 100000  # records held in memory while sorting
+
+Record = namedtuple('Record', ['id', 'node', 'label', 'frequency', 'band',
+                               'digest'])
+
+
+class FrequencyDiff(object):
+
+    headers = ('change', 'id', 'node', 'label', 'old band', 'new band',
+               'old frequency', 'new frequency')
+    changes = ('added', 'removed', 'band', 'frequency', 'unchanged')
+
+    def __init__(self, **kwargs):
+        self.old = kwargs.get('old')
+        self.new = kwargs.get('new')
+        # minimum relative change in frequency that gets reported
+        self.threshold = kwargs.get('threshold', 0.1)
+        self.letters = kwargs.get('letters')
+        self.counts = None
+
+    def compare(self, out_file):
+        self.counts = {change: 0 for change in FrequencyDiff.changes}
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            old = _sorted_records(self.old, self.letters,
+                                  os.path.join(tmp_dir, 'old'))
+            new = _sorted_records(self.new, self.letters,
+                                  os.path.join(tmp_dir, 'new'))
+            with open(out_file, 'w') as filehandle:
+                csvwriter = csv.writer(filehandle)
+                csvwriter.writerow(FrequencyDiff.headers)
+                for change, r1, r2 in self.merge(old, new):
+                    self.counts[change] += 1
+                    if change != 'unchanged':
+                        csvwriter.writerow(_diff_row(change, r1, r2))
+
+    def merge(self, old, new):
+        r1 = next(old, None)
+        r2 = next(new, None)
+        while r1 is not None or r2 is not None:
+            if r2 is None or (r1 is not None and
+                              (r1.id, r1.node) < (r2.id, r2.node)):
+                yield 'removed', r1, None
+                r1 = next(old, None)
+            elif r1 is None or (r2.id, r2.node) < (r1.id, r1.node):
+                yield 'added', None, r2
+                r2 = next(new, None)
+            else:
+                yield self.classify(r1, r2), r1, r2
+                r1 = next(old, None)
+                r2 = next(new, None)
+
+    def classify(self, r1, r2):
+        if r1.digest == r2.digest:
+            return 'unchanged'
+        elif r1.band != r2.band:
+            return 'band'
+        elif _frequency_changed(r1.frequency, r2.frequency, self.threshold):
+            return 'frequency'
+        else:
+            return 'unchanged'
+
+    def write_summary(self, out_file):
+        with open(out_file, 'w') as filehandle:
+            csvwriter = csv.writer(filehandle)
+            csvwriter.writerow(('change', 'num. entries'))
+            for change in FrequencyDiff.changes:
+                csvwriter.writerow((change, self.counts[change]))
+
+    def print_summary(self):
+        for change in FrequencyDiff.changes:
+            print('%s\t%d' % (change, self.counts[change]))
+
+
+def _frequency_changed(f1, f2, threshold):
+    if f1 == f2:
+        return False
+    elif f1 == 0:
+        return True
+    else:
+        return abs(f2 - f1) / f1 > threshold
+
+
+def _diff_row(change, r1, r2):
+    current = r2 or r1
+    return (change,
+            current.id,
+            current.node,
+            current.label,
+            r1.band if r1 else '',
+            r2.band if r2 else '',
+            r1.frequency if r1 else '',
+            r2.frequency if r2 else '',)
+
+
+def _sorted_records(source, letters, run_dir):
+    """
+    Stream records from a build, sort them into runs of RUN_SIZE records
+    on disk, and return an iterator merging the runs in
+    (id, node) order.
+    """
+    os.mkdir(run_dir)
+    runs = []
+    buffer = []
+    for record in _read_records(source, letters):
+        buffer.append(record)
+        if len(buffer) >= RUN_SIZE:
+            runs.append(_write_run(buffer, run_dir, len(runs)))
+            buffer = []
+    if buffer:
+        runs.append(_write_run(buffer, run_dir, len(runs)))
+    return heapq.merge(*[_read_run(r) for r in runs],
+                       key=lambda r: (r.id, r.node))
+
+
+def _write_run(records, run_dir, count):
+    records.sort(key=lambda r: (r.id, r.node))
+    filepath = os.path.join(run_dir, '%04d.csv' % count)
+    with open(filepath, 'w') as filehandle:
+        csvwriter = csv.writer(filehandle)
+        csvwriter.writerows(records)
+    return filepath
+
+
+def _read_run(filepath):
+    with open(filepath, 'r') as filehandle:
+        for row in csv.reader(filehandle):
+            yield Record(int(row[0]), int(row[1]), row[2], float(row[3]),
+                         int(row[4]), row[5])
+
+
+def _read_records(source, letters):
+    if os.path.isdir(source):
+        return _read_frequency_dir(source, letters)
+    else:
+        return _read_csv(source, letters)
+
+
+def _read_frequency_dir(in_dir, letters):
+    iterator = frequency_iterator(in_dir=in_dir,
+                                  letters=letters,
+                                  message='Reading %s' % in_dir)
+    for e in profile_entries(iterator.iterate()):
+        if not e.has_frequency_table():
+            continue
+        ft = e.frequency_table()
+        if e.is_main_entry:
+            node_id = 0
+        else:
+            node_id = int(e.xrnode)
+        yield _record(int(e.id), node_id, e.label,
+                      ft.frequency(period='modern'),
+                      ft.band(period='modern'))
+
+
+def _read_csv(in_file, letters):
+    with open(in_file, 'r') as filehandle:
+        for row in csv.reader(filehandle):
+            entry_id, node_id, label, frequency, band = row[:5]
+            if letters and _initial(label) not in letters:
+                continue
+            yield _record(int(entry_id), int(node_id or 0), label,
+                          frequency, band)
+
+
+def _record(entry_id, node_id, label, frequency, band):
+    frequency = float(frequency)
+    band = int(band)
+    digest = hashlib.md5(('%s\t%r\t%d' % (label, frequency, band))
+                         .encode('utf8')).hexdigest()
+    return Record(entry_id, node_id, label, frequency, band, digest)
+
+
+def _initial(label):
+    """
+    The letter that an entry with the given label is (usually) filed
+    under: the first letter of the label, ignoring accents and any
+    leading punctuation (e.g. '-ness' -> 'n', '\u00e9clat' -> 'e').
+    """
+    for char in unicodedata.normalize('NFKD', label.lower()):
+        char = _LIGATURES.get(char, char)
+        if char in string.ascii_lowercase:
+            return char
+    return None
+
+
+_LIGATURES = {'\u00e6': 'a', '\u0153': 'o', '\u00fe': 't', '\u00f0': 'd'}
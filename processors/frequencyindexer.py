@@ -2,34 +2,47 @@
 frequencyindexer
 """
 
-from collections import defaultdict
+import os
 
 from lxml import etree
 
-from lex.oed.resources.frequencyiterator import FrequencyIterator
+from processors.frequencyreader import frequency_iterator
+from processors.profiling import profile_entries
 
 XSLPI = etree.PI('xml-stylesheet',
                  'type="text/xsl" href="./chrome/xsl/index.xsl"')
 
 
-def index_frequency_files(in_dir, out_file):
-    entry_list = defaultdict(lambda: defaultdict(list))
-    iterator = FrequencyIterator(in_dir=in_dir,
-                                 message='Compiling index')
-    for e in iterator.iterate():
-        entry_list[e.letter][e.filename].append(e.label)
+def index_frequency_files(in_dir, out_file, letters=None,
+                          accumulator=None):
+    """
+    If an accumulator is given (e.g. one already built letter by letter
+    while the files were being collected), the files aren't read again.
 
-    doc = etree.Element('letters')
-    doc.addprevious(XSLPI)
+    If letters is given, only those letters are re-indexed; the other
+    letters' entries in an existing index are kept.
+    """
+    if accumulator is None:
+        accumulator = accumulate_index(in_dir, letters)
+    entry_list = accumulator.finalize()
+
+    letter_nodes = {}
+    if letters is not None and os.path.isfile(out_file):
+        parser = etree.XMLParser(remove_blank_text=True)
+        existing = etree.parse(out_file, parser).getroot()
+        for letter_node in existing.findall('letterSet'):
+            if letter_node.get('letter') not in letters:
+                letter_nodes[letter_node.get('letter')] = letter_node
 
     for letter in sorted(entry_list.keys()):
         num_files = len(entry_list[letter].keys())
         num_entries = sum([len(entry_list[letter][f])
                            for f in entry_list[letter].keys()])
-        letter_node = etree.SubElement(doc, 'letterSet',
-                                       letter=letter,
-                                       files=str(num_files),
-                                       entries=str(num_entries),)
+        letter_node = etree.Element('letterSet',
+                                    letter=letter,
+                                    files=str(num_files),
+                                    entries=str(num_entries),)
+        letter_nodes[letter] = letter_node
 
         for filename in sorted(entry_list[letter].keys()):
             fnode = etree.SubElement(letter_node, 'file',
@@ -41,7 +54,47 @@ def index_frequency_files(in_dir, out_file):
             t2 = etree.SubElement(fnode, 'last')
             t2.text = entry_list[letter][filename][-1]
 
+    doc = etree.Element('letters')
+    doc.addprevious(XSLPI)
+    for letter in sorted(letter_nodes.keys()):
+        doc.append(letter_nodes[letter])
+
     with open(out_file, 'w') as filehandle:
         filehandle.write('<?xml version="1.0" encoding="UTF-8"?>\n')
         filehandle.write(etree.tounicode(doc.getroottree(),
                                          pretty_print=True,))
+
+
+def accumulate_index(in_dir, letters):
+    accumulator = IndexAccumulator()
+    iterator = frequency_iterator(in_dir=in_dir,
+                                  letters=letters,
+                                  message='Compiling index')
+    for e in profile_entries(iterator.iterate()):
+        accumulator.update(e)
+    return accumulator
+
+
+class IndexAccumulator(object):
+
+    """
+    Entry labels in each file, by letter; mergeable, so that the index
+    can be built letter by letter (see processors.shards).
+    """
+
+    def __init__(self):
+        self.entry_list = {}
+
+    def update(self, e):
+        files = self.entry_list.setdefault(e.letter, {})
+        files.setdefault(e.filename, []).append(e.label)
+
+    def merge(self, other):
+        for letter, files in other.entry_list.items():
+            merged = self.entry_list.setdefault(letter, {})
+            for filename, labels in files.items():
+                merged.setdefault(filename, []).extend(labels)
+        return self
+
+    def finalize(self):
+        return self.entry_list
@@ -0,0 +1,255 @@
+"""
+FrequencyReader - Constant-memory reader for frequency XML files
+
+An alternative to lex's FrequencyIterator: walks FREQUENCY_DIR or
+FULL_FREQUENCY_DIR with lxml.etree.iterparse, detaching each <e> element
+from its document as soon as it has been parsed, so that the document
+never grows beyond a single entry. Each entry is yielded as a lightweight
+FrequencyEntry record; frequency tables are only decoded when asked for.
+
+Use frequency_iterator() to get whichever reader is selected by
+frequencyconfig.FREQUENCY_READER. compare_readers() checks that the two
+readers agree on a set of frequency files (same entries, with the same
+attribute values and types, and the same frequency tables).
+"""
+
+import os
+import string
+import itertools
+
+from lxml import etree
+
+from lex.frequencytable import FrequencyTable
+from lex.oed.resources.frequencyiterator import FrequencyIterator
+from processors.profiling import profile_file
+import frequencyconfig
+
+# Child elements that are not frequency tables
+ENTRY_FIELDS = ('label', 'parentLabel', 'lemma', 'definition', 'wordclass')
+WORDCLASS_FIELDS = ('types',)
+TYPE_FIELDS = ('form',)
+
+
+def frequency_iterator(**kwargs):
+    """
+    Returns a FrequencyReader or a FrequencyIterator (depending on
+    frequencyconfig.FREQUENCY_READER), taking the same arguments as
+    FrequencyIterator.
+    """
+    if frequencyconfig.FREQUENCY_READER == 'iterparse':
+        return FrequencyReader(**kwargs)
+    else:
+        return FrequencyIterator(**kwargs)
+
+
+class FrequencyReader(object):
+
+    def __init__(self, **kwargs):
+        self.in_dir = kwargs.get('in_dir')
+        self.letters = kwargs.get('letters') or string.ascii_lowercase
+        self.message = kwargs.get('message')
+
+    def iterate(self):
+        for letter in self.letters:
+            sub_dir = os.path.join(self.in_dir, letter)
+            if not os.path.isdir(sub_dir):
+                continue
+            if self.message:
+                print('%s (%s)...' % (self.message, letter))
+            for filename in sorted(os.listdir(sub_dir)):
+                if filename.endswith('.xml'):
+                    filepath = os.path.join(sub_dir, filename)
+                    with profile_file(letter, filename):
+                        for e in self.iterate_file(filepath, letter,
+                                                   filename):
+                            yield e
+
+    def iterate_file(self, filepath, letter, filename):
+        for _, node in etree.iterparse(filepath, events=('end',), tag='e'):
+            # Detach the element, so that the document being built by
+            #  iterparse doesn't accumulate entries; the record keeps the
+            #  element only for as long as the record itself is kept.
+            node.getparent().remove(node)
+            yield FrequencyEntry(node, letter, filename)
+
+
+class FrequencyEntry(object):
+
+    __slots__ = ('id', 'xrnode', 'label', 'parent_label', 'lemma',
+                 'definition', 'start', 'end', 'is_main_entry', 'obsolete',
+                 'revised', 'letter', 'filename', '_node', '_wordclass_sets',
+                 '_table')
+
+    def __init__(self, node, letter, filename):
+        self.id = int(node.get('xrid'))
+        self.xrnode = node.get('xrnode')
+        self.is_main_entry = node.get('type') == 'entry'
+        self.obsolete = node.get('obsolete') == 'True'
+        self.revised = node.get('revised') == 'True'
+        self.start = _to_int(node.get('firstDate'))
+        self.end = _to_int(node.get('lastDate'))
+        self.label = node.findtext('label')
+        self.parent_label = node.findtext('parentLabel')
+        self.lemma = node.findtext('lemma')
+        self.definition = node.findtext('definition')
+        self.letter = letter
+        self.filename = filename
+        self._node = node
+        self._wordclass_sets = None
+        self._table = _UNDECODED
+
+    def is_obsolete(self):
+        return self.obsolete
+
+    def wordclass_sets(self):
+        if self._wordclass_sets is None:
+            self._wordclass_sets = [WordclassSet(n) for n in
+                                    self._node.iterchildren('wordclass')]
+        return self._wordclass_sets
+
+    def wordclass(self):
+        wordclass_sets = self.wordclass_sets()
+        if wordclass_sets:
+            return wordclass_sets[0].wordclass
+        return None
+
+    def frequency_table(self):
+        if self._table is _UNDECODED:
+            self._table = _decode(self._node, ENTRY_FIELDS,
+                                  self.wordclass_sets())
+        return self._table
+
+    def has_frequency_table(self):
+        return self.frequency_table() is not None
+
+
+class WordclassSet(object):
+
+    __slots__ = ('wordclass', '_node', '_types', '_table')
+
+    def __init__(self, node):
+        self.wordclass = node.get('penn')
+        self._node = node
+        self._types = None
+        self._table = _UNDECODED
+
+    def types(self):
+        if self._types is None:
+            self._types = [TypeUnit(n) for n in
+                           self._node.iterfind('types/type')]
+        return self._types
+
+    def frequency_table(self):
+        if self._table is _UNDECODED:
+            self._table = _decode(self._node, WORDCLASS_FIELDS, self.types())
+        return self._table
+
+    def has_frequency_table(self):
+        return self.frequency_table() is not None
+
+
+class TypeUnit(object):
+
+    __slots__ = ('form', 'wordclass', '_node', '_table')
+
+    def __init__(self, node):
+        self.form = node.findtext('form')
+        self.wordclass = node.get('penn')
+        self._node = node
+        self._table = _UNDECODED
+
+    def frequency_table(self):
+        if self._table is _UNDECODED:
+            self._table = _decode(self._node, TYPE_FIELDS, [])
+        return self._table
+
+    def has_frequency_table(self):
+        return self.frequency_table() is not None
+
+
+_UNDECODED = object()
+
+# Entry attributes and methods compared by compare_readers()
+COMPARED_ATTRIBUTES = ('id', 'xrnode', 'label', 'lemma', 'definition',
+                       'start', 'end', 'is_main_entry', 'letter', 'filename')
+COMPARED_METHODS = ('is_obsolete', 'wordclass')
+
+
+def compare_readers(in_dir, letters=None, limit=100):
+    """
+    Reads in_dir with both FrequencyIterator and FrequencyReader, and
+    returns a list of the differences found (up to limit), as tuples of
+    (entry ID, field, FrequencyIterator's value, FrequencyReader's
+    value). Values are compared along with their types.
+    """
+    tree = FrequencyIterator(in_dir=in_dir, letters=letters)
+    reader = FrequencyReader(in_dir=in_dir, letters=letters)
+    differences = []
+    for e1, e2 in itertools.zip_longest(tree.iterate(), reader.iterate()):
+        if e1 is None or e2 is None:
+            differences.append((getattr(e1 or e2, 'id', None), 'entry',
+                                e1 is not None, e2 is not None))
+        else:
+            differences.extend(_compare_entries(e1, e2))
+        if len(differences) >= limit:
+            break
+    return differences[:limit]
+
+
+def _compare_entries(e1, e2):
+    fields = [(name, getattr(e1, name), getattr(e2, name))
+              for name in COMPARED_ATTRIBUTES]
+    fields.extend([(name + '()', getattr(e1, name)(), getattr(e2, name)())
+                   for name in COMPARED_METHODS])
+    fields.append(('frequency_table', _table_values(e1),
+                   _table_values(e2)))
+    wcs1, wcs2 = e1.wordclass_sets(), e2.wordclass_sets()
+    fields.append(('wordclass_sets', len(wcs1), len(wcs2)))
+    for i, (w1, w2) in enumerate(zip(wcs1, wcs2)):
+        fields.append(('wordclass_sets[%d]' % i,
+                       (_typed(w1.wordclass), _table_values(w1)),
+                       (_typed(w2.wordclass), _table_values(w2))))
+        types1, types2 = w1.types(), w2.types()
+        fields.append(('wordclass_sets[%d].types' % i,
+                       len(types1), len(types2)))
+        for j, (t1, t2) in enumerate(zip(types1, types2)):
+            fields.append(('wordclass_sets[%d].types[%d]' % (i, j),
+                           (_typed(t1.form), _typed(t1.wordclass),
+                            _table_values(t1)),
+                           (_typed(t2.form), _typed(t2.wordclass),
+                            _table_values(t2))))
+    return [(e1.id, name, v1, v2) for name, v1, v2 in fields
+            if _typed(v1) != _typed(v2)]
+
+
+def _table_values(unit):
+    ft = unit.frequency_table()
+    if ft is None:
+        return None
+    return tuple([(p, _typed(ft.frequency(period=p)),
+                   _typed(ft.band(period=p))) for p in sorted(ft.data.keys())])
+
+
+def _typed(value):
+    return (type(value).__name__, value)
+
+
+def _decode(node, fields, children):
+    """
+    Decode the frequency table attached to the node. In terse output,
+    a node with a single child (wordclass set or type) has no table of
+    its own, so the child's table is used instead.
+    """
+    for child in node.iterchildren(tag=etree.Element):
+        if child.tag not in fields:
+            return FrequencyTable(node=child)
+    if len(children) == 1:
+        return children[0].frequency_table()
+    return None
+
+
+def _to_int(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
@@ -0,0 +1,326 @@
+"""
+profiling -- opt-in profiling hooks for pipeline stages
+
+Profiling is switched on by frequencyconfig.PROFILE, or by the
+environment (which takes precedence):
+
+    FREQUENCY_PROFILE          comma-separated list of stages to profile
+                               (or 'all')
+    FREQUENCY_PROFILE_MODE     'cprofile', 'sample', or 'tracemalloc'
+    FREQUENCY_PROFILE_LETTERS  letters to narrow down to, e.g. 'qx'
+    FREQUENCY_PROFILE_FILES    comma-separated frequency files to narrow
+                               down to, e.g. '0001.xml,0002.xml'
+
+If letters or files are given, only those letters (within
+FrequencyCollector.process) or files (within FrequencyIterator consumers)
+are profiled, rather than the stage as a whole. FrequencyReader starts
+each file's profile as it opens the file, so that parsing the file is
+included (see profile_file()); lex's FrequencyIterator doesn't say when
+it opens a file, so with FREQUENCY_READER = 'tree' a file's profile
+starts at its first entry, and its parsing is charged to the previous
+file.
+
+Work done in other threads on behalf of the profiled code (e.g. the
+FrequencyCollector's BufferWriter serialising and writing files) is
+included: the sampling profiler samples every thread, prefixing each
+stack with the thread's name; tracemalloc traces every thread; and
+cProfile profiles the work that threads wrap in profile_thread(),
+merging it into the profile being written. Threaded work is charged to
+whichever profile is active when it starts, so a letter's last files
+may be charged to the next letter.
+
+Output goes to frequencyconfig.PROFILE_DIR:
+    cprofile:    <stage>[-<letter>][-<file>].pstats
+    sample:      <stage>[-<letter>][-<file>].collapsed (for flamegraph.pl)
+    tracemalloc: <stage>[-<letter>][-<file>].txt (top allocations)
+"""
+
+import os
+import sys
+import time
+import threading
+import pstats
+import cProfile
+import tracemalloc
+from collections import defaultdict
+from contextlib import contextmanager
+
+import frequencyconfig
+
+SAMPLE_INTERVAL = 0.005  # seconds between stack samples
+TOP_ALLOCATIONS = 50  # lines in tracemalloc report
+
+# 'threads' collects profile_thread()'s profiles while a cProfile
+#  profile is being taken (None otherwise)
+_state = {'stage': None, 'file': None, 'threads': None}
+
+
+def settings():
+    config = dict(frequencyconfig.PROFILE)
+    if os.environ.get('FREQUENCY_PROFILE'):
+        config['stages'] = _split(os.environ['FREQUENCY_PROFILE'])
+    if os.environ.get('FREQUENCY_PROFILE_MODE'):
+        config['mode'] = os.environ['FREQUENCY_PROFILE_MODE']
+    if os.environ.get('FREQUENCY_PROFILE_LETTERS'):
+        config['letters'] = list(os.environ['FREQUENCY_PROFILE_LETTERS']
+                                 .replace(',', '').lower())
+    if os.environ.get('FREQUENCY_PROFILE_FILES'):
+        config['files'] = _split(os.environ['FREQUENCY_PROFILE_FILES'])
+    if config.get('mode') not in PROFILERS:
+        raise ValueError('Unknown profiling mode: %s' % config.get('mode'))
+    return config
+
+
+def _split(value):
+    return [v.strip() for v in value.split(',') if v.strip()]
+
+
+def is_selected(stage):
+    stages = settings().get('stages') or []
+    return stage in stages or 'all' in stages
+
+
+@contextmanager
+def profile_stage(stage):
+    """
+    Wraps a complete pipeline stage. The stage is profiled as a whole
+    unless letters or files have been selected, in which case it's left
+    to profile_letter() and profile_entries() to profile the narrower
+    units of work.
+    """
+    config = settings()
+    previous = _state['stage']
+    _state['stage'] = stage
+    try:
+        if (is_selected(stage) and
+                not config.get('letters') and
+                not config.get('files')):
+            with _profile(config['mode'], stage):
+                yield
+        else:
+            yield
+    finally:
+        _state['stage'] = previous
+
+
+@contextmanager
+def profile_letter(letter):
+    """
+    Wraps the work done on a single letter (e.g. within
+    FrequencyCollector.process).
+    """
+    config = settings()
+    stage = _state['stage']
+    if (stage is not None and
+            is_selected(stage) and
+            letter in (config.get('letters') or []) and
+            not config.get('files')):
+        with _profile(config['mode'], stage, letter):
+            yield
+    else:
+        yield
+
+
+@contextmanager
+def profile_file(letter, filename):
+    """
+    Wraps a reader's work on a single frequency file, from opening it
+    (so that parsing is included) until the consumer has finished with
+    its last entry. profile_entries() passes through the entries of a
+    file wrapped like this.
+    """
+    config = settings()
+    stage = _state['stage']
+    letters = config.get('letters')
+    files = config.get('files')
+    previous = _state['file']
+    _state['file'] = (letter, filename)
+    try:
+        if (stage is not None and
+                is_selected(stage) and
+                (letters or files) and
+                (not letters or letter in letters) and
+                (not files or filename in files)):
+            with _profile(config['mode'], stage, letter, filename):
+                yield
+        else:
+            yield
+    finally:
+        _state['file'] = previous
+
+
+def profile_entries(entries):
+    """
+    Wraps a FrequencyIterator iteration, profiling the consumer's work
+    on each selected letter and/or file, unless the reader profiles its
+    files itself (see profile_file()). Entries are passed through
+    unchanged.
+    """
+    config = settings()
+    stage = _state['stage']
+    letters = config.get('letters')
+    files = config.get('files')
+    if stage is None or not is_selected(stage) or not (letters or files):
+        for e in entries:
+            yield e
+        return
+
+    current = None
+    profiler = None
+    try:
+        for e in entries:
+            if _state['file'] is not None:
+                # already being profiled by the reader
+                yield e
+                continue
+            unit = (e.letter, e.filename)
+            if unit != current:
+                if profiler is not None:
+                    profiler.__exit__(None, None, None)
+                    profiler = None
+                current = unit
+                if ((not letters or e.letter in letters) and
+                        (not files or e.filename in files)):
+                    profiler = _profile(config['mode'], stage, *unit)
+                    profiler.__enter__()
+            yield e
+    finally:
+        if profiler is not None:
+            profiler.__exit__(None, None, None)
+
+
+@contextmanager
+def profile_thread():
+    """
+    Wraps a unit of work done in another thread on behalf of the code
+    being profiled, so that it's included in a cProfile profile.
+    """
+    profiles = _state['threads']
+    if profiles is None:
+        yield
+        return
+    profiler = cProfile.Profile()
+    try:
+        profiler.enable()
+    except ValueError:
+        # Only one profiler can be active at a time in Python 3.12+,
+        #  where cProfile sees every thread anyway
+        yield
+        return
+    try:
+        yield
+    finally:
+        profiler.disable()
+        profiles.append(profiler)
+
+
+def _profile(mode, stage, *qualifiers):
+    name = '-'.join([stage] + [os.path.splitext(q)[0] for q in qualifiers])
+    if not os.path.isdir(frequencyconfig.PROFILE_DIR):
+        os.makedirs(frequencyconfig.PROFILE_DIR)
+    return PROFILERS[mode](os.path.join(frequencyconfig.PROFILE_DIR, name))
+
+
+@contextmanager
+def _cprofile(basepath):
+    profiler = cProfile.Profile()
+    previous = _state['threads']
+    threads = _state['threads'] = []
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        _state['threads'] = previous
+        stats = pstats.Stats(profiler)
+        for other in list(threads):
+            stats.add(other)
+        stats.dump_stats(basepath + '.pstats')
+
+
+@contextmanager
+def _tracemalloc(basepath):
+    already_tracing = tracemalloc.is_tracing()
+    if not already_tracing:
+        tracemalloc.start(25)
+    start = tracemalloc.take_snapshot()
+    try:
+        yield
+    finally:
+        snapshot = tracemalloc.take_snapshot()
+        if not already_tracing:
+            tracemalloc.stop()
+        stats = snapshot.compare_to(start, 'traceback')
+        with open(basepath + '.txt', 'w') as filehandle:
+            filehandle.write('Top %d allocations\n\n' % TOP_ALLOCATIONS)
+            for stat in stats[:TOP_ALLOCATIONS]:
+                filehandle.write('%s\n' % stat)
+                for line in stat.traceback.format():
+                    filehandle.write('    %s\n' % line)
+                filehandle.write('\n')
+
+
+@contextmanager
+def _sample(basepath):
+    sampler = StackSampler()
+    sampler.start()
+    try:
+        yield
+    finally:
+        sampler.stop()
+        sampler.write(basepath + '.collapsed')
+
+
+class StackSampler(object):
+
+    """
+    Samples the stacks of every other thread at regular intervals,
+    collecting counts of collapsed stacks (the input format for
+    flamegraph.pl), each prefixed with its thread's name.
+    """
+
+    def __init__(self, interval=SAMPLE_INTERVAL):
+        self.interval = interval
+        self.stacks = defaultdict(int)
+        self.halt = threading.Event()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self):
+        self.halt.set()
+        self.thread.join()
+
+    def run(self):
+        own_id = threading.get_ident()
+        while not self.halt.is_set():
+            names = {thread.ident: thread.name
+                     for thread in threading.enumerate()}
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id != own_id:
+                    name = names.get(thread_id, str(thread_id))
+                    self.stacks['%s;%s' % (name, _collapse(frame))] += 1
+            time.sleep(self.interval)
+
+    def write(self, filepath):
+        with open(filepath, 'w') as filehandle:
+            for stack, count in sorted(self.stacks.items()):
+                filehandle.write('%s %d\n' % (stack, count))
+
+
+def _collapse(frame):
+    names = []
+    while frame is not None:
+        code = frame.f_code
+        names.append('%s:%s' % (os.path.basename(code.co_filename),
+                                code.co_name))
+        frame = frame.f_back
+    return ';'.join(reversed(names))
+
+
+PROFILERS = {
+    'cprofile': _cprofile,
+    'sample': _sample,
+    'tracemalloc': _tracemalloc,
+}
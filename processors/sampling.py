@@ -0,0 +1,101 @@
+"""
+sampling -- deterministic sampling of entries, and whole-dictionary
+estimates from samples
+
+Entries are selected by hashing their entry ID, so a given sample rate
+always selects the same entries, in every stage (and subentries are
+always sampled along with their parent entry).
+
+Estimates are scaled up from the sample to the whole dictionary, and
+given with bootstrap confidence intervals.
+"""
+
+import math
+import hashlib
+from statistics import NormalDist
+
+import numpy
+
+RESAMPLES = 1000  # bootstrap resamples
+CONFIDENCE = 95  # % confidence interval
+SEED = 0  # bootstrap resampling is seeded, so estimates are reproducible
+
+
+def in_sample(entry_id, rate):
+    digest = hashlib.md5(str(entry_id).encode('utf8')).digest()
+    return int.from_bytes(digest[:8], 'big') / 2 ** 64 < rate
+
+
+def sample_entries(entries, rate):
+    """
+    Filter an iteration of entries down to the sample. If rate is None,
+    all entries are passed through.
+    """
+    for e in entries:
+        if rate is None or in_sample(e.id, rate):
+            yield e
+
+
+def estimate_count(count, rate):
+    """
+    Estimate the whole-dictionary number of entries from the number
+    sampled. The sample size is itself binomially distributed, which
+    bootstrapping can't capture, so a normal approximation is used.
+
+    Returns (estimate, low, high).
+    """
+    z = NormalDist().inv_cdf(1 - (100 - CONFIDENCE) / 200)
+    margin = z * math.sqrt(count * (1 - rate)) / rate
+    estimate = count / rate
+    return estimate, max(estimate - margin, count), estimate + margin
+
+
+def estimate_totals(contributions, rate):
+    """
+    Estimate whole-dictionary column totals from a (sampled entries x
+    columns) array of per-entry contributions.
+
+    Returns three arrays: the estimated totals, and the lower and upper
+    bounds of the confidence interval.
+    """
+    contributions = numpy.asarray(contributions, dtype=float)
+    size = len(contributions)
+    estimate = contributions.sum(axis=0) / rate
+    if not size:
+        return estimate, estimate, estimate
+    resampled = numpy.empty((RESAMPLES, contributions.shape[1]))
+    state = numpy.random.RandomState(SEED)
+    for i in range(RESAMPLES):
+        # Resampling with replacement, expressed as a count of how many
+        #  times each entry is drawn
+        weights = numpy.bincount(state.randint(0, size, size),
+                                 minlength=size)
+        resampled[i] = weights.dot(contributions) / rate
+    low, high = _interval(resampled)
+    return estimate, low, high
+
+
+def estimate_statistics(values, statistics):
+    """
+    Estimate statistics (a dict of name -> function of an array of
+    values) from a sample, e.g. means or percentiles of a score.
+
+    Returns a list of (name, estimate, low, high) tuples.
+    """
+    values = numpy.asarray(values, dtype=float)
+    output = []
+    if not len(values):
+        return output
+    state = numpy.random.RandomState(SEED)
+    resamples = [values[state.randint(0, len(values), len(values))]
+                 for _ in range(RESAMPLES)]
+    for name in sorted(statistics.keys()):
+        func = statistics[name]
+        low, high = _interval(numpy.array([func(r) for r in resamples]))
+        output.append((name, func(values), low, high))
+    return output
+
+
+def _interval(resampled):
+    tail = (100 - CONFIDENCE) / 2
+    return numpy.percentile(resampled, [tail, 100 - tail], axis=0)
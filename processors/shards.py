@@ -0,0 +1,100 @@
+"""
+shards -- map-reduce driver for running analyses letter by letter across
+a process pool
+
+An analysis is split into an accumulate function, which reads a shard
+of entries (a list of letters) into an accumulator, and the
+accumulator's merge() and finalize() methods. Each letter is accumulated
+in a separate task, and the partial results are merged in letter order
+-- the order in which a serial run reads them -- so that the output is
+the same as a serial run's.
+
+Accumulators (and the accumulate function, which is usually a bound
+method) must be picklable.
+
+LetterStream runs the same accumulate functions on letters as they're
+published by a producer (e.g. FrequencyCollector), so that downstream
+stages keep pace with the producer rather than waiting for it to finish.
+"""
+
+import string
+import multiprocessing
+
+# Resources shared by all the shards handled by a pool worker (None
+#  outside a pool worker)
+_worker_resources = None
+
+
+def map_reduce(accumulate, letters, processes):
+    """
+    Returns the merged (not yet finalized) accumulator for the given
+    letters (None for the full alphabet). If processes is 0 or 1, the
+    letters are accumulated in a single pass in this process.
+    """
+    if not processes or processes <= 1:
+        return accumulate(letters)
+    letters = list(letters or string.ascii_lowercase)
+    with multiprocessing.Pool(processes, initializer=_init_worker) as pool:
+        partials = pool.map(accumulate, [[letter] for letter in letters],
+                            chunksize=1)
+    accumulator = partials[0]
+    for partial in partials[1:]:
+        accumulator.merge(partial)
+    return accumulator
+
+
+class LetterStream(object):
+
+    """
+    Hands each published letter to every consumer (name -> accumulate
+    function) added beforehand, running them in a process pool while the
+    producer carries on. result() waits for a consumer's letters, and
+    returns its accumulator, merged in the order the letters were
+    published.
+    """
+
+    def __init__(self, processes):
+        # The pool is started straight away, so that workers are forked
+        #  before the producer starts any threads
+        self.pool = multiprocessing.Pool(max(processes, 1),
+                                         initializer=_init_worker)
+        self.consumers = {}
+
+    def add(self, name, accumulate):
+        self.consumers[name] = (accumulate, [])
+
+    def has(self, name):
+        return name in self.consumers
+
+    def publish(self, letter):
+        for accumulate, partials in self.consumers.values():
+            partials.append(self.pool.apply_async(accumulate, ([letter],)))
+
+    def result(self, name):
+        _, partials = self.consumers.pop(name)
+        accumulator = partials[0].get()
+        for partial in partials[1:]:
+            accumulator.merge(partial.get())
+        return accumulator
+
+    def close(self):
+        self.pool.terminate()
+        self.pool.join()
+
+
+def resource(factory):
+    """
+    Returns factory(). In a pool worker, the instance is kept and reused
+    for every shard the worker handles, so that expensive resources
+    (e.g. VitalStatisticsCache) are only loaded once per process.
+    """
+    if _worker_resources is None:
+        return factory()
+    if factory not in _worker_resources:
+        _worker_resources[factory] = factory()
+    return _worker_resources[factory]
+
+
+def _init_worker():
+    global _worker_resources
+    _worker_resources = {}
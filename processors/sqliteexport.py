@@ -0,0 +1,157 @@
+"""
+SqliteExporter - Loads frequency data into an indexed SQLite database
+
+Tables:
+    entries         one row per entry or subentry, keyed by (id, node);
+                    node is 0 for main entries
+    wordclass_sets  one row per wordclass set, keyed by (id, node, wcs)
+    types           one row per type, keyed by (id, node, wcs, type)
+    frequencies     one row per period for each entry, wordclass set, and
+                    type; wcs and type are 0 at the levels above
+
+Every table has a 'letter' column, so that the database can be refreshed
+one letter at a time.
+"""
+
+import sqlite3
+
+from processors.frequencyreader import frequency_iterator
+from processors.profiling import profile_entries
+
+BATCH_SIZE = 10000  # rows held per table before inserting
+
+SCHEMA = (
+    """CREATE TABLE IF NOT EXISTS entries (
+        id INTEGER, node INTEGER, letter TEXT, label TEXT, lemma TEXT,
+        is_main_entry INTEGER, obsolete INTEGER, first_date INTEGER,
+        last_date INTEGER, frequency REAL, band INTEGER,
+        PRIMARY KEY (id, node))""",
+    """CREATE TABLE IF NOT EXISTS wordclass_sets (
+        id INTEGER, node INTEGER, wcs INTEGER, letter TEXT, wordclass TEXT,
+        frequency REAL, band INTEGER,
+        PRIMARY KEY (id, node, wcs))""",
+    """CREATE TABLE IF NOT EXISTS types (
+        id INTEGER, node INTEGER, wcs INTEGER, type INTEGER, letter TEXT,
+        form TEXT, wordclass TEXT, frequency REAL, band INTEGER,
+        PRIMARY KEY (id, node, wcs, type))""",
+    """CREATE TABLE IF NOT EXISTS frequencies (
+        id INTEGER, node INTEGER, wcs INTEGER, type INTEGER, letter TEXT,
+        period TEXT, frequency REAL, band INTEGER)""",
+)
+
+# Created after loading, so that a first build doesn't pay for index
+#  maintenance on every insert
+INDEXES = (
+    'CREATE INDEX IF NOT EXISTS entries_band ON entries (band)',
+    'CREATE INDEX IF NOT EXISTS entries_lemma ON entries (lemma)',
+    'CREATE INDEX IF NOT EXISTS entries_letter ON entries (letter)',
+    'CREATE INDEX IF NOT EXISTS wordclass_sets_wordclass ON wordclass_sets '
+    '(wordclass)',
+    'CREATE INDEX IF NOT EXISTS wordclass_sets_letter ON wordclass_sets '
+    '(letter)',
+    'CREATE INDEX IF NOT EXISTS types_letter ON types (letter)',
+    'CREATE INDEX IF NOT EXISTS frequencies_id ON frequencies (id, node)',
+    'CREATE INDEX IF NOT EXISTS frequencies_letter ON frequencies (letter)',
+)
+
+INSERTS = {
+    'entries': 'INSERT INTO entries VALUES (?,?,?,?,?,?,?,?,?,?,?)',
+    'wordclass_sets': 'INSERT INTO wordclass_sets VALUES (?,?,?,?,?,?,?)',
+    'types': 'INSERT INTO types VALUES (?,?,?,?,?,?,?,?,?)',
+    'frequencies': 'INSERT INTO frequencies VALUES (?,?,?,?,?,?,?,?)',
+}
+
+
+class SqliteExporter(object):
+
+    def __init__(self, **kwargs):
+        self.in_dir = kwargs.get('in_dir')
+        self.db_file = kwargs.get('db_file')
+        # If letters is None, the whole database is rebuilt; otherwise
+        #  only rows for the given letters are replaced.
+        self.letters = kwargs.get('letters')
+
+    def build(self):
+        connection = sqlite3.connect(self.db_file)
+        try:
+            connection.execute('PRAGMA synchronous = OFF')
+            with connection:
+                for statement in SCHEMA:
+                    connection.execute(statement)
+                self.clear(connection)
+                self.load(connection)
+                for statement in INDEXES:
+                    connection.execute(statement)
+            connection.execute('ANALYZE')
+        finally:
+            connection.close()
+
+    def clear(self, connection):
+        for table in INSERTS.keys():
+            if self.letters is None:
+                connection.execute('DELETE FROM %s' % table)
+            else:
+                connection.executemany(
+                    'DELETE FROM %s WHERE letter = ?' % table,
+                    [(letter,) for letter in self.letters])
+
+    def load(self, connection):
+        self.rows = {table: [] for table in INSERTS.keys()}
+        iterator = frequency_iterator(in_dir=self.in_dir,
+                                      letters=self.letters,
+                                      message='Loading SQLite database')
+        for e in profile_entries(iterator.iterate()):
+            self.add_entry(e)
+            if max([len(rows) for rows in self.rows.values()]) >= BATCH_SIZE:
+                self.insert(connection)
+        self.insert(connection)
+
+    def insert(self, connection):
+        for table, rows in self.rows.items():
+            if rows:
+                connection.executemany(INSERTS[table], rows)
+                self.rows[table] = []
+
+    def add_entry(self, e):
+        if e.is_main_entry:
+            node_id = 0
+        else:
+            node_id = int(e.xrnode)
+        key = (int(e.id), node_id)
+        frequency, band = self.add_frequencies(e, key + (0, 0), e.letter)
+        self.rows['entries'].append(key + (e.letter, e.label, e.lemma,
+                                           int(e.is_main_entry),
+                                           int(e.is_obsolete()),
+                                           e.start, e.end, frequency, band))
+
+        for i, wcs in enumerate(e.wordclass_sets()):
+            wcs_key = key + (i + 1,)
+            frequency, band = self.add_frequencies(wcs, wcs_key + (0,),
+                                                   e.letter)
+            self.rows['wordclass_sets'].append(wcs_key + (e.letter,
+                                                          wcs.wordclass,
+                                                          frequency, band))
+            for j, type_unit in enumerate(wcs.types()):
+                type_key = wcs_key + (j + 1,)
+                frequency, band = self.add_frequencies(type_unit, type_key,
+                                                       e.letter)
+                self.rows['types'].append(type_key + (e.letter,
+                                                      type_unit.form,
+                                                      type_unit.wordclass,
+                                                      frequency, band))
+
+    def add_frequencies(self, block, key, letter):
+        """
+        Add per-period rows for the block's frequency table (if any), and
+        return its modern frequency and band.
+        """
+        ft = block.frequency_table()
+        if ft is None:
+            return None, None
+        for period in ft.data.keys():
+            self.rows['frequencies'].append(key + (
+                letter,
+                period,
+                ft.frequency(period=period),
+                ft.band(period=period)))
+        return ft.frequency(period='modern'), ft.band(period='modern')
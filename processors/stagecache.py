@@ -0,0 +1,206 @@
+"""
+StageCache - Content-addressed cache of pipeline stage outputs
+
+Each stage run is fingerprinted from the contents of its input files
+(or directories), the values of the config settings it depends on, and
+the source code of the modules that implement it. Outputs are stored
+under the fingerprint; if the stage is run again with the same
+fingerprint, the cached outputs are copied back instead of running the
+stage.
+
+The cache is kept under a size limit, evicting the least recently used
+entries first.
+
+Digests of input files are remembered (keyed on path, size and
+modification time) so that unchanged inputs aren't read again on every
+run. Remembered digests of files that have since changed or gone are
+dropped when the cache is evicted.
+"""
+
+import os
+import json
+import shutil
+import hashlib
+
+DIGEST_FILE = 'digests.json'
+MANIFEST_FILE = 'manifest.json'
+BLOCK_SIZE = 1024 * 1024
+
+
+class StageCache(object):
+
+    def __init__(self, cache_dir, max_size):
+        self.cache_dir = cache_dir
+        self.max_size = max_size
+        if not os.path.isdir(cache_dir):
+            os.makedirs(cache_dir)
+        self.digests = _load_json(os.path.join(cache_dir, DIGEST_FILE), {})
+
+    def fingerprint(self, stage, inputs, config, code):
+        """
+        inputs: list of file or directory paths
+        config: dict of config setting names -> values
+        code: list of source file paths
+        """
+        hasher = hashlib.sha256()
+        hasher.update(stage.encode('utf8'))
+        for path in code:
+            hasher.update(self.path_digest(path).encode('utf8'))
+        for name in sorted(config.keys()):
+            hasher.update(('%s=%r' % (name, config[name])).encode('utf8'))
+        for path in inputs:
+            hasher.update(self.path_digest(path).encode('utf8'))
+        self.save_digests()
+        return hasher.hexdigest()
+
+    def path_digest(self, path):
+        if os.path.isdir(path):
+            hasher = hashlib.sha256()
+            for root, dirs, files in os.walk(path):
+                dirs.sort()
+                for filename in sorted(files):
+                    filepath = os.path.join(root, filename)
+                    hasher.update(os.path.relpath(filepath, path)
+                                  .encode('utf8'))
+                    hasher.update(self.file_digest(filepath).encode('utf8'))
+            return hasher.hexdigest()
+        elif os.path.isfile(path):
+            return self.file_digest(path)
+        else:
+            return 'missing:%s' % path
+
+    def file_digest(self, filepath):
+        status = os.stat(filepath)
+        signature = [status.st_size, status.st_mtime_ns]
+        remembered = self.digests.get(filepath)
+        if remembered is not None and remembered[0] == signature:
+            return remembered[1]
+        hasher = hashlib.sha256()
+        with open(filepath, 'rb') as filehandle:
+            for block in iter(lambda: filehandle.read(BLOCK_SIZE), b''):
+                hasher.update(block)
+        self.digests[filepath] = [signature, hasher.hexdigest()]
+        return hasher.hexdigest()
+
+    def save_digests(self):
+        _write_json(os.path.join(self.cache_dir, DIGEST_FILE), self.digests)
+
+    def restore(self, key, outputs):
+        """
+        Copy cached outputs back into place. Returns False if there's no
+        cache entry for the key.
+        """
+        entry_dir = os.path.join(self.cache_dir, key)
+        manifest = _load_json(os.path.join(entry_dir, MANIFEST_FILE), None)
+        if manifest is None or sorted(manifest.keys()) != sorted(outputs):
+            return False
+        for path in outputs:
+            if manifest[path] is not None:
+                _copy(os.path.join(entry_dir, manifest[path]), path)
+            else:
+                # The stage didn't produce this output, so any existing
+                #  copy is left over from a different run
+                _remove(path)
+        # The manifest's modification time marks when the entry was last
+        #  used, for LRU eviction
+        os.utime(os.path.join(entry_dir, MANIFEST_FILE))
+        return True
+
+    def store(self, key, outputs):
+        entry_dir = os.path.join(self.cache_dir, key)
+        tmp_dir = os.path.join(self.cache_dir, '.tmp-%s-%d' % (key,
+                                                               os.getpid()))
+        if os.path.isdir(tmp_dir):
+            shutil.rmtree(tmp_dir)
+        os.makedirs(tmp_dir)
+        manifest = {}
+        for i, path in enumerate(outputs):
+            if os.path.exists(path):
+                manifest[path] = '%04d' % i
+                _copy(path, os.path.join(tmp_dir, manifest[path]))
+            else:
+                manifest[path] = None
+        _write_json(os.path.join(tmp_dir, MANIFEST_FILE), manifest)
+
+        if _size(tmp_dir) > self.max_size:
+            shutil.rmtree(tmp_dir)
+            return
+        if os.path.isdir(entry_dir):
+            shutil.rmtree(entry_dir)
+        os.rename(tmp_dir, entry_dir)
+        self.evict()
+
+    def evict(self):
+        entries = []
+        for key in os.listdir(self.cache_dir):
+            manifest_file = os.path.join(self.cache_dir, key, MANIFEST_FILE)
+            if os.path.isfile(manifest_file):
+                entries.append((os.stat(manifest_file).st_mtime,
+                                _size(os.path.join(self.cache_dir, key)),
+                                key))
+        total = sum([size for _, size, _ in entries])
+        for _, size, key in sorted(entries):
+            if total <= self.max_size:
+                break
+            shutil.rmtree(os.path.join(self.cache_dir, key))
+            total -= size
+        self.prune_digests()
+
+    def prune_digests(self):
+        """
+        Forget the digests of files that no longer exist, or have changed
+        since they were digested.
+        """
+        for filepath, (signature, _) in list(self.digests.items()):
+            try:
+                status = os.stat(filepath)
+            except OSError:
+                status = None
+            if (status is None or
+                    [status.st_size, status.st_mtime_ns] != signature):
+                del self.digests[filepath]
+        self.save_digests()
+
+
+def _copy(source, destination):
+    if os.path.isdir(destination):
+        shutil.rmtree(destination)
+    parent = os.path.dirname(destination)
+    if parent and not os.path.isdir(parent):
+        os.makedirs(parent)
+    if os.path.isdir(source):
+        shutil.copytree(source, destination)
+    else:
+        shutil.copy2(source, destination)
+
+
+def _remove(path):
+    if os.path.isdir(path):
+        shutil.rmtree(path)
+    elif os.path.exists(path):
+        os.remove(path)
+
+
+def _size(path):
+    if os.path.isfile(path):
+        return os.path.getsize(path)
+    total = 0
+    for root, _, files in os.walk(path):
+        for filename in files:
+            total += os.path.getsize(os.path.join(root, filename))
+    return total
+
+
+def _load_json(filepath, default):
+    try:
+        with open(filepath) as filehandle:
+            return json.load(filehandle)
+    except (FileNotFoundError, ValueError):
+        return default
+
+
+def _write_json(filepath, data):
+    tmp_path = '%s.%d' % (filepath, os.getpid())
+    with open(tmp_path, 'w') as filehandle:
+        json.dump(data, filehandle)
+    os.replace(tmp_path, filepath)
@@ -1,13 +1,41 @@
 import csv
-from lex.oed.resources.frequencyiterator import FrequencyIterator
+from processors.frequencyreader import frequency_iterator
+from processors.profiling import profile_entries
 
 
-def xml_to_csv(in_dir, out_file):
-    iterator = FrequencyIterator(in_dir=in_dir, message='Populating .csv file')
-    entries = []
-    for e in iterator.iterate():
+def xml_to_csv(in_dir, out_file, letters=None, accumulator=None):
+    if accumulator is None:
+        accumulator = accumulate_rows(in_dir, letters)
+    entries = accumulator.finalize()
+
+    with open(out_file, 'w') as filehandle:
+        csvwriter = csv.writer(filehandle)
+        csvwriter.writerows(entries)
+
+
+def accumulate_rows(in_dir, letters):
+    accumulator = RowAccumulator()
+    iterator = frequency_iterator(in_dir=in_dir,
+                                  letters=letters,
+                                  message='Populating .csv file')
+    for e in profile_entries(iterator.iterate()):
+        accumulator.update(e)
+    return accumulator
+
+
+class RowAccumulator(object):
+
+    """
+    .csv rows for a shard of entries; mergeable, so that the file can be
+    built letter by letter (see processors.shards).
+    """
+
+    def __init__(self):
+        self.rows = []
+
+    def update(self, e):
         if not e.has_frequency_table():
-            continue
+            return
 
         frequency = e.frequency_table().frequency(period='modern')
         band = e.frequency_table().band(period='modern')
@@ -19,8 +47,11 @@ def xml_to_csv(in_dir, out_file):
             node_id = e.xrnode
 
         row = (entry_id, node_id, label, frequency, band)
-        entries.append(row)
+        self.rows.append(row)
 
-    with open(out_file, 'w') as filehandle:
-        csvwriter = csv.writer(filehandle)
-        csvwriter.writerows(entries)
+    def merge(self, other):
+        self.rows.extend(other.rows)
+        return self
+
+    def finalize(self):
+        return self.rows
@@ -0,0 +1,113 @@
+"""
+Multi-process tests of the file-based task queue in
+processors/coordinator.py
+"""
+
+import os
+import sys
+import time
+import multiprocessing
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from processors import coordinator
+
+TIMING = {'poll': 0.05, 'lease': 1, 'max_attempts': 3}
+
+
+def _record(coord_dir, task):
+    # Appends are atomic for short writes, so every run of every task
+    #  can be counted from one file
+    with open(os.path.join(coord_dir, 'runs.log'), 'a') as filehandle:
+        filehandle.write('%s %d\n' % (task, os.getpid()))
+
+
+def _runs(coord_dir):
+    with open(os.path.join(coord_dir, 'runs.log')) as filehandle:
+        return [line.split()[0] for line in filehandle]
+
+
+def _handlers(coord_dir):
+    def ok(shard, staging_dir):
+        _record(coord_dir, 'ok-' + shard)
+        time.sleep(0.1)
+        os.makedirs(staging_dir)
+        with open(os.path.join(staging_dir, 'out'), 'w') as filehandle:
+            filehandle.write(shard)
+
+    def bad(shard, staging_dir):
+        _record(coord_dir, 'bad-' + shard)
+        raise ValueError('bad shard %s' % shard)
+
+    def slow(shard, staging_dir):
+        # Outlives its lease on the first attempt, whose worker then dies
+        #  without completing it; later attempts succeed
+        _record(coord_dir, 'slow-' + shard)
+        if _runs(coord_dir).count('slow-' + shard) == 1:
+            time.sleep(TIMING['lease'] * 3)
+            os._exit(1)
+        os.makedirs(staging_dir)
+
+    return {'ok': ok, 'bad': bad, 'slow': slow}
+
+
+def _worker(coord_dir):
+    coordinator.run_worker(coord_dir, _handlers(coord_dir),
+                           poll=TIMING['poll'], lease=TIMING['lease'],
+                           heartbeat=TIMING['lease'] * 10,
+                           max_attempts=TIMING['max_attempts'])
+
+
+def _run(coord_dir, tasks, workers=4):
+    queue = coordinator.TaskQueue(coord_dir)
+    queue.reset()
+    queue.publish(tasks)
+    processes = [multiprocessing.Process(target=_worker, args=(coord_dir,))
+                 for _ in range(workers)]
+    for process in processes:
+        process.start()
+    try:
+        return coordinator.wait(coord_dir, poll=TIMING['poll'],
+                                lease=TIMING['lease'],
+                                max_attempts=TIMING['max_attempts'])
+    finally:
+        for process in processes:
+            process.join(timeout=30)
+            assert not process.is_alive()
+
+
+def test_each_task_completed_once(tmp_path):
+    coord_dir = str(tmp_path / 'coord')
+    tasks = ['ok-%s' % letter for letter in 'abcdefghijkl']
+    results = _run(coord_dir, tasks)
+    assert sorted(results.keys()) == tasks
+    for task, staging_dir in results.items():
+        with open(os.path.join(staging_dir, 'out')) as filehandle:
+            assert filehandle.read() == task.split('-', 1)[1]
+    assert sorted(_runs(coord_dir)) == tasks
+
+
+def test_failing_task_is_given_up_on(tmp_path):
+    coord_dir = str(tmp_path / 'coord')
+    tasks = ['bad-x'] + ['ok-%s' % letter for letter in 'abcdef']
+    try:
+        _run(coord_dir, tasks)
+    except coordinator.TaskFailure as failure:
+        assert list(failure.failures.keys()) == ['bad-x']
+        assert 'bad shard x' in failure.failures['bad-x']
+    else:
+        raise AssertionError('TaskFailure not raised')
+    runs = _runs(coord_dir)
+    assert runs.count('bad-x') == TIMING['max_attempts']
+    # The workers carried on after the errors
+    assert sorted(set(runs) - {'bad-x'}) == tasks[1:]
+    queue = coordinator.TaskQueue(coord_dir)
+    assert sorted(queue.results().keys()) == tasks[1:]
+
+
+def test_expired_lease_is_reassigned(tmp_path):
+    coord_dir = str(tmp_path / 'coord')
+    tasks = ['slow-s', 'ok-a', 'ok-b']
+    results = _run(coord_dir, tasks, workers=2)
+    assert sorted(results.keys()) == sorted(tasks)
+    assert _runs(coord_dir).count('slow-s') == 2
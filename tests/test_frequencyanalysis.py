@@ -0,0 +1,145 @@
+"""
+Parity check for processors/frequencyanalysis.py: the 'iterative' and
+'matrix' modes, run in a single pass or in shards that are then merged,
+must write byte-for-byte identical .csv files.
+"""
+
+import os
+import sys
+import random
+import filecmp
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+pytest.importorskip('lex')
+
+from processors import frequencyanalysis
+
+PERIODS = ('1750-99', '1800-49', '1850-99', '1900-19', '1950-59',
+           'modern', '1800-99', '1950-99')
+ENTRIES = 5000
+SHARD_SIZE = 700
+
+
+class Table(object):
+
+    def __init__(self, data):
+        self.data = data
+
+    def frequency(self, period='modern'):
+        return self.data.get(period, 0.0)
+
+    def band(self, period='modern'):
+        frequency = self.frequency(period)
+        for band, limit in enumerate((1000, 100, 10, 1, 0.1, 0.01, 0.001)):
+            if frequency >= limit:
+                return band + 1
+        return 16
+
+    def delta(self, p1, p2):
+        if not self.frequency(p1):
+            return None
+        return self.frequency(p2) / self.frequency(p1)
+
+
+class WordclassSet(object):
+
+    wordclass = 'VB'
+
+    def frequency_table(self):
+        return Table({'modern': 0.5})
+
+    def has_frequency_table(self):
+        return True
+
+    def types(self):
+        return []
+
+
+class Entry(object):
+
+    def __init__(self, i, rand):
+        self.id = i
+        # repeated labels, so that ties have to be broken the same way
+        self.label = 'entry%d' % (i % 700)
+        self.lemma = rand.choice(('word', 'two words', 'hyphen-ated'))
+        self.start = rand.choice((1500, 1700, 1760, 1800))
+        self.obsolete = rand.random() < 0.2
+        if rand.random() < 0.1:
+            self.table = None
+        else:
+            self.table = Table({p: _frequency(rand) for p in PERIODS
+                                if rand.random() < 0.9})
+
+    def is_obsolete(self):
+        return self.obsolete
+
+    def has_frequency_table(self):
+        return self.table is not None
+
+    def frequency_table(self):
+        return self.table
+
+    def wordclass_sets(self):
+        return [WordclassSet()]
+
+
+class VitalStatistics(object):
+
+    def find(self, entry_id, field=None):
+        if field == 'header':
+            return 'rare' if entry_id % 7 == 0 else ''
+        if field == 'quotations':
+            return (entry_id * 13) % 40
+
+
+def _frequency(rand):
+    if rand.random() < 0.5:
+        return rand.choice((0.0, 0.0001, 0.5, 0.6, 1.0, 2.0, 0.15, 0.25))
+    return 10 ** rand.uniform(-5, 3.5)
+
+
+def _write(accumulator, out_dir):
+    os.makedirs(out_dir)
+    analysis = frequencyanalysis.FrequencyAnalysis(out_dir=out_dir)
+    analysis.track = accumulator.finalize()
+    analysis.matrix = accumulator.matrix
+    analysis.write()
+    return sorted(os.listdir(out_dir))
+
+
+def _accumulate(cls, entries, shard_size):
+    vs = VitalStatistics()
+    shards = []
+    for k in range(0, len(entries), shard_size):
+        accumulator = cls()
+        for e in entries[k:k + shard_size]:
+            accumulator.update(e, vs)
+        shards.append(accumulator)
+    accumulator = shards[0]
+    for shard in shards[1:]:
+        accumulator.merge(shard)
+    return accumulator
+
+
+def test_modes_and_shards_agree(tmp_path):
+    rand = random.Random(3)
+    entries = [Entry(i, rand) for i in range(ENTRIES)]
+    runs = {}
+    for cls in (frequencyanalysis.AnalysisAccumulator,
+                frequencyanalysis.MatrixAccumulator):
+        for shard_size in (ENTRIES, SHARD_SIZE):
+            name = '%s-%d' % (cls.__name__, shard_size)
+            out_dir = str(tmp_path / name)
+            runs[name] = (out_dir, _write(_accumulate(cls, entries,
+                                                      shard_size), out_dir))
+    baseline_dir, filenames = runs.pop('AnalysisAccumulator-%d' % ENTRIES)
+    assert len(filenames) == 10
+    for name, (out_dir, other_filenames) in runs.items():
+        assert other_filenames == filenames
+        for filename in filenames:
+            assert filecmp.cmp(os.path.join(baseline_dir, filename),
+                               os.path.join(out_dir, filename),
+                               shallow=False), (name, filename)
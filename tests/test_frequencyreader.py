@@ -0,0 +1,26 @@
+"""
+Parity check between lex's FrequencyIterator and the iterparse
+FrequencyReader (processors/frequencyreader.py), run on the frequency
+files built by collect_frequencies. Skipped if lex or the files aren't
+available.
+"""
+
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+pytest.importorskip('lex')
+
+import frequencyconfig
+from processors.frequencyreader import compare_readers
+
+
+@pytest.mark.parametrize('in_dir', ['FREQUENCY_DIR', 'FULL_FREQUENCY_DIR'])
+def test_readers_agree(in_dir):
+    in_dir = getattr(frequencyconfig, in_dir)
+    if not os.path.isdir(in_dir):
+        pytest.skip('%s has not been built' % in_dir)
+    assert compare_readers(in_dir) == []